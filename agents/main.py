@@ -1,35 +1,44 @@
 import os
-import openai
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from langchain.chat_models import ChatOpenAI
 from langchain.agents import load_tools
 from langchain.agents import initialize_agent
 from langchain.utilities import SerpAPIWrapper
+from tools import TTLCache, cached_tool, calculator_tool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.clients import configure_openai, get_chat_model
+from common.llm_cache import install_llm_cache
 
 class LangChainManager:
-    def __init__(self):
+    #search_tool replaces serpapi, e.g. StubSearch().as_tool() in tests and benchmarks.
+    #tool results are cached for cache_ttl seconds and plain arithmetic skips the llm-math round-trip
+    def __init__(self, search_tool=None, cache_ttl=3600):
         load_dotenv()
-        openai.api_type = "azure"
-        openai.api_version = "2023-05-15"
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-        openai.api_base = os.getenv("OPENAI_API_BASE")
+        configure_openai()
+        self.llm_cache = install_llm_cache()
 
-        self.llm = ChatOpenAI(temperature=0, model_kwargs={"engine": "GPT3-5"})
-        self.tools = load_tools(["serpapi", "llm-math"], llm=self.llm)
+        self.llm = get_chat_model(temperature=0)
+        self.tool_cache = TTLCache(ttl_seconds=cache_ttl)
+        search_tool = search_tool or load_tools(["serpapi"], llm=self.llm)[0]
+        llm_math_tool = load_tools(["llm-math"], llm=self.llm)[0]
+        self.tools = [cached_tool(search_tool, self.tool_cache), cached_tool(calculator_tool(llm_math_tool), self.tool_cache)]
 
         self.zero_shot_agent = self.initialize_zero_shot_agent()
 
-    def initialize_zero_shot_agent(self):
+    def initialize_zero_shot_agent(self, verbose=True):
         return initialize_agent(
             agent="zero-shot-react-description",
             tools=self.tools,
             llm=self.llm,
-            verbose=True,
+            verbose=verbose,
             max_iterations=3
         )
 
-    def run_queries(self):
-        queries = [
+    #the queries are independent, so up to max_concurrency of them run at once; responses keep query order
+    def run_queries(self, queries=None, max_concurrency=3):
+        queries = queries or [
             "what is (4.5*2.1)^2.2?",
             """if Mary has four apples and Giorgio brings two and a half apple 
             boxes (apple box contains eight apples), how many apples do we 
@@ -37,9 +46,12 @@ class LangChainManager:
             "what is the capital of Norway?"
         ]
 
-        for query in queries:
-            response = self.zero_shot_agent(query)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            responses = list(executor.map(self.zero_shot_agent, queries))
+        for response in responses:
             print(response)
+        print({"tool_cache_hits": self.tool_cache.hits, "tool_cache_misses": self.tool_cache.misses})
+        return responses
 
 if __name__ == "__main__":
     manager = LangChainManager()
@@ -0,0 +1,140 @@
+import ast
+import math
+import time
+import operator
+import threading
+from collections import OrderedDict
+
+from langchain.agents import Tool
+
+#tool helpers for LangChainManager: a ttl cache in front of any tool, a calculator that does plain
+#arithmetic locally before falling back to llm-math, and a stub search tool for tests and benchmarks.
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+UNARY_OPERATORS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+#powers past ~10^300 are left to llm-math, so nested powers cannot eat cpu or memory
+MAX_POWER_DIGITS = 300
+
+SEARCH_DESCRIPTION = "A search engine. Useful for when you need to answer questions about current events. Input should be a search query."
+CALCULATOR_DESCRIPTION = "Useful for when you need to answer questions about math."
+
+
+def safe_eval(expression):
+    #value of an expression made only of numbers, + - * / // % ** ^ and parentheses.
+    #raises ValueError for anything else, so names, calls and attributes never run
+    def evaluate(node):
+        if isinstance(node, ast.Expression):
+            return evaluate(node.body)
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            return node.value
+        if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+            return UNARY_OPERATORS[type(node.op)](evaluate(node.operand))
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+            left, right = evaluate(node.left), evaluate(node.right)
+            if type(node.op) is ast.Pow and abs(right) * math.log10(max(abs(left), 2)) > MAX_POWER_DIGITS:
+                raise ValueError("power too large to evaluate locally")
+            return BINARY_OPERATORS[type(node.op)](left, right)
+        raise ValueError(f"not plain arithmetic: {ast.dump(node)}")
+
+    #agents write powers as 2^3, as the llm-math prompt does. rewritten to ** before parsing, so ^ gets the
+    #precedence and right associativity of a power rather than of python's xor
+    expression = expression.strip().replace("\n", " ").replace("^", "**")
+    try:
+        value = evaluate(ast.parse(expression, mode="eval"))
+    except (SyntaxError, ZeroDivisionError, OverflowError, TypeError) as error:
+        raise ValueError(str(error)) from error
+    if isinstance(value, complex):
+        raise ValueError("result is not a real number")
+    return value
+
+
+class TTLCache:
+    #thread-safe mapping whose entries expire after ttl_seconds; least recently used go beyond max_entries
+    def __init__(self, ttl_seconds=3600, max_entries=1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def cached_tool(tool, cache):
+    #same tool with its results memoised in cache under (tool name, normalised input)
+    def run(tool_input):
+        key = (tool.name, " ".join(tool_input.split()).lower())
+        result = cache.get(key)
+        if result is None:
+            result = tool.func(tool_input)
+            cache.put(key, result)
+        return result
+
+    return Tool(name=tool.name, description=tool.description, func=run)
+
+
+def calculator_tool(llm_math_tool=None):
+    #answers plain arithmetic locally in llm-math's "Answer: ..." format; anything else goes to llm_math_tool
+    def run(expression):
+        try:
+            return f"Answer: {safe_eval(expression)}"
+        except ValueError:
+            if llm_math_tool is None:
+                raise
+            return llm_math_tool.func(expression)
+
+    description = llm_math_tool.description if llm_math_tool is not None else CALCULATOR_DESCRIPTION
+    return Tool(name="Calculator", description=description, func=run)
+
+
+class StubSearch:
+    #offline stand-in for the serpapi "Search" tool. answers maps queries to results (case and
+    #whitespace are ignored); calls records every query, latency simulates a network round-trip
+    def __init__(self, answers=None, default="No good search result found", latency=0.0):
+        self.answers = {" ".join(query.split()).lower(): answer for query, answer in (answers or {}).items()}
+        self.default = default
+        self.latency = latency
+        self.calls = []
+
+    def run(self, query):
+        self.calls.append(query)
+        if self.latency:
+            time.sleep(self.latency)
+        return self.answers.get(" ".join(query.split()).lower(), self.default)
+
+    def as_tool(self):
+        return Tool(name="Search", description=SEARCH_DESCRIPTION, func=self.run)
+
+
+if __name__ == "__main__":
+    #^ is a power with the usual precedence
+    assert safe_eval("2*3^2") == 18
+    assert safe_eval("1+2^2") == 5
+    assert safe_eval("2^3^2") == 512
+    assert safe_eval("-2^2") == -4
+    print("safe_eval ok")
@@ -0,0 +1,91 @@
+import re
+import time
+import random
+import hashlib
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain.llms.base import LLM
+from langchain.embeddings.base import Embeddings
+from langchain.docstore.document import Document
+
+WORD_PATTERN = re.compile(r"\w+")
+
+VOCABULARY = (
+    "budget tax revenue growth capital expenditure infrastructure railway scheme mission farmers "
+    "agriculture credit digital health education women youth green energy hydrogen housing "
+    "customs duty exemption deficit borrowing states cooperative startup msme export tourism "
+    "skilling pradhan mantri amrit kaal vision inclusive development fiscal allocation crore"
+).split()
+
+
+class FakeLLM(LLM):
+    # Offline, deterministic stand-in for the Azure chat model. Every call sleeps `latency` seconds
+    # and answers with `response_tokens` words; `responder(prompt)` can return a prompt-specific
+    # answer instead (e.g. ReAct steps for the agent). Tokens are counted as words.
+
+    latency: float = 0.05
+    response_tokens: int = 60
+    responder: Any = None
+    model_name: str = "fake-llm"
+    model_kwargs: dict = {}
+    temperature: float = 0.0
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def _llm_type(self):
+        return "fake"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> str:
+        time.sleep(self.latency)
+        if self.responder is not None:
+            text = self.responder(prompt)
+        else:
+            seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+            rng = random.Random(seed)
+            text = " ".join(rng.choice(VOCABULARY) for _ in range(self.response_tokens))
+        self.calls += 1
+        self.prompt_tokens += self.get_num_tokens(prompt)
+        self.completion_tokens += self.get_num_tokens(text)
+        return text
+
+    def get_num_tokens(self, text: str) -> int:
+        return len(WORD_PATTERN.findall(text))
+
+
+class HashEmbeddings(Embeddings):
+    # Deterministic bag-of-words embeddings: every word is hashed to a signed slot of a
+    # `dim`-sized vector. Texts sharing words end up close, so retrieval still finds related chunks
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in WORD_PATTERN.findall(text.lower()):
+            digest = int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16)
+            vector[digest % self.dim] += 1.0 if digest & 1 << 31 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def synthetic_corpus(n_chunks, words_per_chunk=150, n_sources=10, seed=0):
+    # Chunks shaped like the split PDF pages the pipelines produce, with source and page metadata
+    rng = random.Random(seed)
+    docs = []
+    for i in range(n_chunks):
+        text = " ".join(rng.choice(VOCABULARY) for _ in range(words_per_chunk))
+        docs.append(Document(page_content=f"chunk {i} {text}", metadata={"source": f"input/doc_{i % n_sources}.pdf", "page": i // n_sources}))
+    return docs
+
+
+def synthetic_queries(n_queries, words_per_query=6, seed=1):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(VOCABULARY) for _ in range(words_per_query)) for _ in range(n_queries)]
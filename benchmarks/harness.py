@@ -0,0 +1,72 @@
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_timed(fn, items, concurrency=1):
+    # Calls fn on every item with up to `concurrency` in flight; returns (latencies, wall seconds)
+    def timed(item):
+        start = time.perf_counter()
+        fn(item)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    if concurrency <= 1:
+        latencies = [timed(item) for item in items]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(timed, items))
+    return latencies, time.perf_counter() - start
+
+
+def summarize(pipeline, stage, params, latencies, elapsed, **extra):
+    # One machine-readable result row; latencies are per item (query, turn, chunk batch, ...)
+    row = {
+        "pipeline": pipeline,
+        "stage": stage,
+        "params": params,
+        "items": len(latencies),
+        "seconds": round(elapsed, 4),
+        "throughput_per_s": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(1000 * percentile(latencies, 50), 3) if latencies else None,
+        "p99_ms": round(1000 * percentile(latencies, 99), 3) if latencies else None,
+    }
+    row.update(extra)
+    return row
+
+
+def _measure(fn, kwargs):
+    rows = fn(**kwargs)
+    rss = peak_rss_mb()
+    for row in rows:
+        row["peak_rss_mb"] = rss
+    return rows
+
+
+def run_isolated(fn, **kwargs):
+    # Runs one benchmark case in a fresh child process, so imports, caches and the peak RSS of one
+    # case do not leak into the next. fn returns a list of result rows
+    context = multiprocessing.get_context("fork" if sys.platform != "win32" else "spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(_measure, fn, kwargs).result()
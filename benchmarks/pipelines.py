@@ -0,0 +1,199 @@
+import os
+import sys
+import time
+import asyncio
+
+from benchmarks.fakes import FakeLLM, HashEmbeddings, synthetic_corpus, synthetic_queries
+from benchmarks.harness import run_timed, summarize
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+#one function per pipeline. each runs in its own child process (see harness.run_isolated): it puts
+#the pipeline directory on sys.path, swaps in the fakes, works inside workdir and returns result rows.
+
+
+def _enter(pipeline_dir, workdir):
+    # Every pipeline has a main.py, so only one pipeline directory may be importable per process
+    sys.path.insert(0, os.path.join(REPO, pipeline_dir))
+    sys.path.insert(1, REPO)
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    # Clients are constructed but never called; langchain only checks that a key is set
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("OPENAI_API_BASE", "http://localhost")
+
+
+def batch_row(pipeline, stage, params, items, elapsed, **extra):
+    row = summarize(pipeline, stage, params, [], elapsed, **extra)
+    row["items"] = items
+    row["throughput_per_s"] = round(items / elapsed, 2) if elapsed else None
+    return row
+
+
+def faiss_pipeline(workdir, n_chunks, concurrency, llm_latency, n_queries=50):
+    _enter("faiss", workdir)
+    from langchain.vectorstores import FAISS
+    from langchain.chains.question_answering import load_qa_chain
+    from hybrid_search import BM25Index
+    from context_packer import ContextPacker
+    from main import DocumentSearch
+
+    params = {"chunks": n_chunks, "concurrency": concurrency, "llm_latency": llm_latency}
+    embeddings = HashEmbeddings()
+    docs = synthetic_corpus(n_chunks)
+    queries = synthetic_queries(n_queries)
+    rows = []
+
+    start = time.perf_counter()
+    texts = [doc.page_content for doc in docs]
+    db = FAISS.from_embeddings(list(zip(texts, embeddings.embed_documents(texts))), embeddings, metadatas=[doc.metadata for doc in docs])
+    bm25 = BM25Index.from_faiss(db)
+    rows.append(batch_row("faiss", "ingest", params, n_chunks, time.perf_counter() - start))
+
+    search = DocumentSearch(embedding_db=db, bm25_index=bm25)
+    latencies, elapsed = run_timed(lambda query: search.search_similarity(query, k=5), queries, concurrency)
+    rows.append(summarize("faiss", "dense_search", params, latencies, elapsed))
+    latencies, elapsed = run_timed(lambda query: search.hybrid_search(query, k=5), queries, concurrency)
+    rows.append(summarize("faiss", "hybrid_search", params, latencies, elapsed))
+
+    llm = FakeLLM(latency=llm_latency)
+    chain = load_qa_chain(llm, chain_type="stuff")
+    packer = ContextPacker(token_budget=1200)
+
+    def answer(query):
+        packed, _ = packer.pack(search.hybrid_search(query, k=5))
+        return chain.run(input_documents=packed, question=query)
+
+    latencies, elapsed = run_timed(answer, queries, concurrency)
+    rows.append(summarize("faiss", "qa", params, latencies, elapsed, llm_calls=llm.calls, prompt_tokens=llm.prompt_tokens))
+    return rows
+
+
+def weaviate_pipeline(workdir, n_chunks, concurrency, llm_latency, n_queries=50):
+    _enter("weviate", workdir)
+    from main import LangChainApp
+    from inmemory_client import InMemoryWeaviateClient
+    from common.answer_cache import AnswerCache
+
+    params = {"chunks": n_chunks, "concurrency": concurrency, "llm_latency": llm_latency}
+    app = LangChainApp(weaviate_client=InMemoryWeaviateClient(), cache_dir=workdir)
+    app.embeddings = HashEmbeddings()
+    app.llm = FakeLLM(latency=llm_latency)
+    app.answer_cache = AnswerCache(path=os.path.join(workdir, "answers.sqlite"), embeddings=app.embeddings)
+    docs = synthetic_corpus(n_chunks)
+    queries = synthetic_queries(n_queries)
+    rows = []
+
+    start = time.perf_counter()
+    retriever = app.build_vector_store(docs)
+    rows.append(batch_row("weaviate", "ingest", params, n_chunks, time.perf_counter() - start, ingest=app.ingest_report))
+    start = time.perf_counter()
+    app.build_vector_store(docs)
+    rows.append(batch_row("weaviate", "reingest_unchanged", params, n_chunks, time.perf_counter() - start, ingest=app.ingest_report))
+
+    # One chain per query, as query_many does for independent sessions
+    latencies, elapsed = run_timed(lambda query: app.query_qa(query, app.build_qa_chain(retriever)), queries, concurrency)
+    rows.append(summarize("weaviate", "query", params, latencies, elapsed, llm_calls=app.llm.calls))
+    latencies, elapsed = run_timed(lambda query: app.query_qa(query, app.build_qa_chain(retriever)), queries, concurrency)
+    rows.append(summarize("weaviate", "query_answer_cached", params, latencies, elapsed, cache_hits=app.answer_cache.hits))
+    return rows
+
+
+def summarise_pipeline(workdir, n_chunks, concurrency, llm_latency):
+    _enter("summarise", workdir)
+    import langchain
+    from main import FileSummarizer
+
+    params = {"chunks": n_chunks, "concurrency": concurrency, "llm_latency": llm_latency}
+    summarizer = FileSummarizer("synthetic.pdf", cache_path=os.path.join(workdir, "summaries.sqlite"))
+    # Fake completions must reach the summary cache, not the shared prompt cache on disk
+    langchain.llm_cache = None
+    summarizer.chat_model = FakeLLM(latency=llm_latency, response_tokens=80)
+    texts = [doc.page_content for doc in synthetic_corpus(n_chunks, words_per_chunk=200)]
+    summarizer.load_chunks = lambda: texts
+    rows = []
+
+    for stage in ("map_reduce_cold", "map_reduce_cached"):
+        start = time.perf_counter()
+        summarizer.map_reduce_summary(max_workers=concurrency)
+        rows.append(batch_row("summarise", stage, params, n_chunks, time.perf_counter() - start,
+                              timings={name: round(seconds, 4) for name, seconds in summarizer.timings.items()}, **summarizer.stats))
+    return rows
+
+
+def chains_pipeline(workdir, n_articles, concurrency, llm_latency):
+    _enter("chains", workdir)
+    from batch_runner import BatchRunner
+
+    params = {"articles": n_articles, "concurrency": concurrency, "llm_latency": llm_latency}
+    articles = [(str(i), doc.page_content) for i, doc in enumerate(synthetic_corpus(n_articles, words_per_chunk=400))]
+    runner = BatchRunner(FakeLLM(latency=llm_latency), checkpoint_path=os.path.join(workdir, "updates.jsonl"), max_concurrency=concurrency)
+
+    start = time.perf_counter()
+    asyncio.run(runner.run(articles))
+    elapsed = time.perf_counter() - start
+    rows = [summarize("chains", stage, params, runner.stats.latencies[stage], elapsed, errors=runner.stats.errors[stage]) for stage in ("facts", "investor_update")]
+    rows.append(batch_row("chains", "pipeline", params, n_articles, elapsed))
+    return rows
+
+
+def agents_pipeline(workdir, n_queries, concurrency, llm_latency, search_latency=0.1):
+    _enter("agents", workdir)
+    from langchain.agents import initialize_agent
+    from tools import StubSearch, TTLCache, cached_tool, calculator_tool
+
+    def responder(prompt):
+        # ReAct steps: one tool call, then a final answer once an observation is in the scratchpad
+        question = prompt.rsplit("Question:", 1)[-1]
+        if "Observation:" in question:
+            return " I now know the final answer\nFinal Answer: " + question.split("Observation:")[-1].split("\n")[0].strip()
+        query = question.split("\n")[0].strip()
+        if query.startswith("what is "):
+            return f" I should calculate this.\nAction: Calculator\nAction Input: {query[len('what is '):].rstrip('?')}"
+        return f" I should search for this.\nAction: Search\nAction Input: {query}"
+
+    params = {"queries": n_queries, "concurrency": concurrency, "llm_latency": llm_latency, "search_latency": search_latency}
+    search = StubSearch(latency=search_latency)
+    cache = TTLCache()
+    llm = FakeLLM(latency=llm_latency, responder=responder)
+    agent = initialize_agent(tools=[cached_tool(search.as_tool(), cache), cached_tool(calculator_tool(), cache)],
+                             llm=llm, agent="zero-shot-react-description", max_iterations=3)
+
+    # Half arithmetic, half searches from a small pool, so repeated tool inputs hit the cache
+    search_queries = synthetic_queries(10, words_per_query=4)
+    queries = [f"what is ({i % 7}+2.5)^2?" if i % 2 else search_queries[i % 10] for i in range(n_queries)]
+    latencies, elapsed = run_timed(agent.run, queries, concurrency)
+    return [summarize("agents", "run_queries", params, latencies, elapsed, llm_calls=llm.calls, search_calls=len(search.calls),
+                      tool_cache_hits=cache.hits, tool_cache_misses=cache.misses)]
+
+
+def memory_pipeline(workdir, turns, strategy, llm_latency):
+    _enter("buffer_memory", workdir)
+    from langchain.chains import ConversationChain
+    from langchain.memory import ConversationBufferMemory, ConversationBufferWindowMemory, ConversationTokenBufferMemory, ConversationSummaryMemory
+    from local_token_buffer import LocalTokenBufferMemory
+    from background_summary import BackgroundSummaryMemory
+
+    factories = {
+        "buffer": lambda llm: ConversationBufferMemory(),
+        "window": lambda llm: ConversationBufferWindowMemory(k=2),
+        "token": lambda llm: ConversationTokenBufferMemory(llm=llm, max_token_limit=100),
+        "local_token": lambda llm: LocalTokenBufferMemory(max_token_limit=100),
+        "summary": lambda llm: ConversationSummaryMemory(llm=llm),
+        "background_summary": lambda llm: BackgroundSummaryMemory(llm=llm),
+    }
+    params = {"turns": turns, "strategy": strategy, "llm_latency": llm_latency}
+    messages = synthetic_queries(turns, words_per_query=20)
+    rows = []
+
+    llm = FakeLLM(latency=llm_latency, response_tokens=40)
+    conversation = ConversationChain(llm=llm, memory=factories[strategy](llm))
+    latencies, elapsed = run_timed(lambda message: conversation.predict(input=message), messages)
+    rows.append(summarize("buffer_memory", "turn", params, latencies, elapsed, llm_calls=llm.calls))
+
+    # Memory reads and writes alone, i.e. the per-turn overhead a strategy adds on top of the reply
+    memory_llm = FakeLLM(latency=llm_latency, response_tokens=40)
+    memory = factories[strategy](memory_llm)
+    latencies, elapsed = run_timed(lambda message: (memory.load_memory_variables({}), memory.save_context({"input": message}, {"output": message})), messages)
+    rows.append(summarize("buffer_memory", "memory_ops", params, latencies, elapsed, llm_calls=memory_llm.calls))
+    return rows
@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from benchmarks import pipelines
+from benchmarks.harness import run_isolated
+
+#runs every pipeline against the offline fakes across corpus sizes and concurrency levels, one child
+#process per case, and writes all result rows as json. --compare prints the change against an earlier run.
+
+MEMORY_STRATEGIES = ("buffer", "window", "token", "local_token", "summary", "background_summary")
+
+
+def cases(quick, llm_latency):
+    sizes = (200,) if quick else (1000, 10000)
+    concurrencies = (1, 4) if quick else (1, 4, 16)
+    turns = (20,) if quick else (20, 200)
+    for n_chunks in sizes:
+        for concurrency in concurrencies:
+            yield "faiss", pipelines.faiss_pipeline, dict(n_chunks=n_chunks, concurrency=concurrency, llm_latency=llm_latency)
+            yield "weaviate", pipelines.weaviate_pipeline, dict(n_chunks=n_chunks, concurrency=concurrency, llm_latency=llm_latency)
+    for n_chunks in (50,) if quick else (100, 400):
+        for concurrency in concurrencies:
+            yield "summarise", pipelines.summarise_pipeline, dict(n_chunks=n_chunks, concurrency=concurrency, llm_latency=llm_latency)
+            yield "chains", pipelines.chains_pipeline, dict(n_articles=n_chunks, concurrency=concurrency, llm_latency=llm_latency)
+            yield "agents", pipelines.agents_pipeline, dict(n_queries=n_chunks, concurrency=concurrency, llm_latency=llm_latency)
+    for n_turns in turns:
+        for strategy in MEMORY_STRATEGIES:
+            yield "buffer_memory", pipelines.memory_pipeline, dict(turns=n_turns, strategy=strategy, llm_latency=llm_latency)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(row):
+    return row["pipeline"], row["stage"], json.dumps(row["params"], sort_keys=True)
+
+
+def compare(rows, baseline_path):
+    # Relative change of throughput and p50 per (pipeline, stage, params) present in both runs
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = {case_key(row): row for row in json.load(file)["results"]}
+    for row in rows:
+        before = baseline.get(case_key(row))
+        if "error" in row:
+            print(f"{row['pipeline']} {row['params']}: failed, {row['error']}")
+            continue
+        if before is None or "error" in before:
+            continue
+        changes = []
+        for metric in ("throughput_per_s", "p50_ms", "p99_ms", "peak_rss_mb"):
+            if row.get(metric) and before.get(metric):
+                changes.append(f"{metric} {100 * (row[metric] / before[metric] - 1):+.1f}%")
+        print(f"{row['pipeline']}/{row['stage']} {row['params']}: {', '.join(changes)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", nargs="*", help="pipelines to run, e.g. faiss buffer_memory")
+    parser.add_argument("--quick", action="store_true", help="small corpora and few concurrency levels")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds every fake llm call takes")
+    parser.add_argument("--output", help="result file, default benchmarks/results/<timestamp>.json")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    started = time.strftime("%Y%m%dT%H%M%S")
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for index, (name, fn, params) in enumerate(cases(args.quick, args.llm_latency)):
+            if args.only and name not in args.only:
+                continue
+            print(f"{name} {params}", flush=True)
+            # Fresh directory per case, so no sqlite cache or checkpoint carries over
+            try:
+                case_rows = run_isolated(fn, workdir=os.path.join(workdir, str(index)), **params)
+            except Exception as error:
+                # A failing case becomes an error row, the remaining cases still run
+                print(f"  failed: {error!r}")
+                rows.append({"pipeline": name, "stage": "error", "params": params, "error": repr(error)})
+                continue
+            for row in case_rows:
+                print(f"  {row['stage']}: {row['throughput_per_s']}/s p50 {row['p50_ms']}ms p99 {row['p99_ms']}ms rss {row['peak_rss_mb']}MB")
+                rows.append(row)
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", f"{started}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    meta = {"started": started, "commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "quick": args.quick, "llm_latency": args.llm_latency}
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({"meta": meta, "results": rows}, file, indent=2)
+    print(f"results written to {output}")
+
+    if args.compare:
+        compare(rows, args.compare)
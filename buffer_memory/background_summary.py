@@ -0,0 +1,100 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pydantic import PrivateAttr
+from langchain.memory import ConversationSummaryMemory
+from langchain.schema import SystemMessage, get_buffer_string
+
+# One bounded pool shared by every BackgroundSummaryMemory, so a server with thousands of sessions
+# runs at most this many summarizations at once instead of keeping a thread per session
+MAX_SUMMARY_WORKERS = 4
+_executor = ThreadPoolExecutor(max_workers=MAX_SUMMARY_WORKERS, thread_name_prefix="background-summary")
+
+
+class BackgroundSummaryMemory(ConversationSummaryMemory):
+    # ConversationSummaryMemory that summarizes off the request path. New turns are kept verbatim
+    # and the reply is returned straight away. Once summarize_every turns or max_pending_tokens
+    # tokens are pending, they are folded into the running summary on the shared pool, one
+    # summarization at a time per memory. A turn always reads the summary together with the turns it
+    # does not cover yet, so nothing is lost or repeated while a summary is being written. A failed
+    # summarization keeps its turns pending; it is reported on the next load_memory_variables.
+
+    summarize_every: int = 4
+    max_pending_tokens: int = 400
+
+    _lock = PrivateAttr(default_factory=threading.Lock)
+    _future = PrivateAttr(default=None)
+    _pending_tokens = PrivateAttr(default=0)
+
+    def snapshot(self):
+        # (summary, turns not in the summary yet), taken together
+        with self._lock:
+            return self.buffer, list(self.chat_memory.messages)
+
+    def load_memory_variables(self, inputs):
+        self._report_error()
+        summary, pending = self.snapshot()
+        if self.return_messages:
+            value = ([SystemMessage(content=summary)] if summary else []) + pending
+        else:
+            pending_str = get_buffer_string(pending, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+            value = "\n".join(part for part in (summary, pending_str) if part)
+        return {self.memory_key: value}
+
+    def save_context(self, inputs, outputs):
+        input_str, output_str = self._get_input_output(inputs, outputs)
+        tokens = self.llm.get_num_tokens(input_str) + self.llm.get_num_tokens(output_str)
+        with self._lock:
+            self.chat_memory.add_user_message(input_str)
+            self.chat_memory.add_ai_message(output_str)
+            self._pending_tokens += tokens
+            due = len(self.chat_memory.messages) >= 2 * self.summarize_every or self._pending_tokens >= self.max_pending_tokens
+        if due:
+            self._schedule()
+
+    def _schedule(self):
+        self._report_error()
+        with self._lock:
+            if self._future is not None and not self._future.done():
+                # The running summarization picks nothing new up; the next turn schedules again
+                return
+            self._future = _executor.submit(self._summarize, self.buffer, list(self.chat_memory.messages))
+
+    def _report_error(self):
+        # Reports a failed background summarization once; its turns are summarized again later
+        with self._lock:
+            future = self._future
+            if future is None or not future.done() or future.exception() is None:
+                return
+            self._future = None
+        print(f"background summarization failed, turns kept pending: {future.exception()!r}")
+
+    def _summarize(self, summary, messages):
+        new_summary = self.predict_new_summary(messages, summary)
+        with self._lock:
+            # Summary and remaining turns change together, so readers see one or the other state
+            self.buffer = new_summary
+            del self.chat_memory.messages[:len(messages)]
+            self._pending_tokens = sum(self.llm.get_num_tokens(message.content) for message in self.chat_memory.messages)
+
+    def restore(self, summary, messages):
+        # Loads a snapshot saved elsewhere, e.g. by the chat server's session store
+        with self._lock:
+            self.buffer = summary
+            self.chat_memory.messages = list(messages)
+            self._pending_tokens = sum(self.llm.get_num_tokens(message.content) for message in messages)
+
+    def flush(self):
+        # Waits for a running summarization and folds in every pending turn, e.g. before exit
+        if self._future is not None:
+            self._future.result()
+        summary, messages = self.snapshot()
+        if messages:
+            self._summarize(summary, messages)
+
+    def clear(self):
+        if self._future is not None:
+            self._future.result()
+        with self._lock:
+            super().clear()
+            self._pending_tokens = 0
@@ -0,0 +1,52 @@
+import time
+import statistics
+
+from langchain.llms.fake import FakeListLLM
+from langchain.memory import ConversationSummaryMemory
+from langchain.chains import ConversationChain
+
+from background_summary import BackgroundSummaryMemory
+
+
+#per-turn latency of the summary chatbot with the synchronous ConversationSummaryMemory and with
+#BackgroundSummaryMemory. a fake llm with fixed latency stands in for azure openai, so the numbers
+#only reflect how many llm calls sit on the request path.
+
+class SlowFakeLLM(FakeListLLM):
+    latency: float = 0.5
+    calls: int = 0
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        self.calls += 1
+        return self.responses[self.calls % len(self.responses)]
+
+    def get_num_tokens(self, text):
+        return len(text.split())
+
+
+def run(memory_factory, turns, latency):
+    llm = SlowFakeLLM(responses=["A short reply about the budget and its main points."], latency=latency)
+    memory = memory_factory(llm)
+    conversation = ConversationChain(llm=llm, memory=memory)
+
+    timings = []
+    for turn in range(turns):
+        start = time.perf_counter()
+        conversation.predict(input=f"Question number {turn} about the budget speech?")
+        timings.append(time.perf_counter() - start)
+    if isinstance(memory, BackgroundSummaryMemory):
+        memory.flush()
+
+    return {
+        "mean_turn_seconds": round(statistics.mean(timings), 3),
+        "p50_turn_seconds": round(statistics.median(timings), 3),
+        "max_turn_seconds": round(max(timings), 3),
+        "llm_calls": llm.calls,
+    }
+
+
+if __name__ == "__main__":
+    turns, latency = 20, 0.5
+    print("sync      ", run(lambda llm: ConversationSummaryMemory(llm=llm), turns, latency))
+    print("background", run(lambda llm: BackgroundSummaryMemory(llm=llm, summarize_every=4), turns, latency))
@@ -0,0 +1,278 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import asyncio
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from langchain.memory import ConversationBufferMemory, ConversationBufferWindowMemory
+from langchain.chains import ConversationChain
+from langchain.schema import messages_to_dict, messages_from_dict
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.clients import configure_openai, get_chat_model
+from local_token_buffer import LocalTokenBufferMemory
+from background_summary import BackgroundSummaryMemory
+
+STRATEGIES = ("buffer", "window", "token", "summary")
+
+
+#multi-session version of the ChatBots in this directory. every session picks one of the four memory
+#strategies; live sessions sit in an in-process LRU cache and are written to sqlite when they are
+#evicted, go idle or the server stops, and are reloaded from there on their next message.
+#protocol: one json object per line, {"session_id", "message", "strategy"?} -> {"session_id", "reply"}
+
+def create_memory(strategy, llm, window_k=2, max_token_limit=100, summarize_every=4):
+    if strategy == "buffer":
+        return ConversationBufferMemory()
+    if strategy == "window":
+        return ConversationBufferWindowMemory(k=window_k)
+    if strategy == "token":
+        return LocalTokenBufferMemory(max_token_limit=max_token_limit)
+    if strategy == "summary":
+        return BackgroundSummaryMemory(llm=llm, summarize_every=summarize_every)
+    raise ValueError(f"unknown memory strategy {strategy!r}, expected one of {STRATEGIES}")
+
+
+def dump_memory(memory):
+    # (summary, messages) that recreate the memory; summary is only used by the summary strategy
+    if isinstance(memory, BackgroundSummaryMemory):
+        summary, messages = memory.snapshot()
+        return summary, messages
+    if isinstance(memory, LocalTokenBufferMemory):
+        return "", memory.buffer
+    if isinstance(memory, ConversationBufferWindowMemory):
+        #the chat history keeps growing, only the last k exchanges are ever read back
+        return "", list(memory.chat_memory.messages[-2 * memory.k:]) if memory.k > 0 else []
+    return "", list(memory.chat_memory.messages)
+
+
+def restore_memory(memory, summary, messages):
+    if isinstance(memory, BackgroundSummaryMemory):
+        memory.restore(summary, messages)
+    elif isinstance(memory, LocalTokenBufferMemory):
+        memory.add_messages(messages)
+    else:
+        memory.chat_memory.messages = list(messages)
+
+
+class SessionStore:
+    #sqlite table of evicted sessions, one row per session
+    def __init__(self, path="chat_sessions.sqlite"):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            strategy TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            messages TEXT NOT NULL,
+            updated REAL NOT NULL)""")
+        self.conn.commit()
+
+    def load(self, session_id):
+        with self.lock:
+            row = self.conn.execute("SELECT strategy, summary, messages FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        strategy, summary, messages = row
+        return strategy, summary, messages_from_dict(json.loads(messages))
+
+    def save_many(self, rows):
+        #rows of (session_id, strategy, summary, messages)
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)",
+                [(session_id, strategy, summary, json.dumps(messages_to_dict(messages)), time.time()) for session_id, strategy, summary, messages in rows])
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class Session:
+    def __init__(self, session_id, strategy, memory, conversation):
+        self.session_id = session_id
+        self.strategy = strategy
+        self.memory = memory
+        self.conversation = conversation
+        #one turn at a time per session, turns of different sessions run concurrently
+        self.lock = asyncio.Lock()
+        #turns running or queued on the lock; such sessions are not evicted
+        self.active = 0
+        self.last_used = time.monotonic()
+        self.dirty = False
+
+
+class ChatServer:
+    def __init__(self, llm, store, default_strategy="buffer", max_sessions=1000, idle_seconds=300, max_concurrency=64, **memory_options):
+        if default_strategy not in STRATEGIES:
+            raise ValueError(f"unknown memory strategy {default_strategy!r}, expected one of {STRATEGIES}")
+        self.llm = llm
+        self.store = store
+        self.default_strategy = default_strategy
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.max_concurrency = max_concurrency
+        self.memory_options = memory_options
+        self.sessions = OrderedDict()
+        #sessions being written to the store; a message arriving meanwhile takes the session back
+        self.evicting = {}
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        #llm calls block, so they run on a pool sized to the number of turns allowed in flight
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.stats = {"turns": 0, "created": 0, "reloaded": 0, "evicted": 0}
+
+    def _new_session(self, session_id, strategy, summary="", messages=()):
+        memory = create_memory(strategy, self.llm, **self.memory_options)
+        if summary or messages:
+            restore_memory(memory, summary, messages)
+        conversation = ConversationChain(llm=self.llm, memory=memory)
+        return Session(session_id, strategy, memory, conversation)
+
+    #returns the session already marked active, so no eviction running while this turn waits can take it;
+    #the caller ends the turn with session.active -= 1
+    async def get_session(self, session_id, strategy=None):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.sessions.move_to_end(session_id)
+            session.active += 1
+            return session
+        session = self.evicting.get(session_id)
+        if session is not None:
+            self.sessions[session_id] = session
+            session.active += 1
+            return session
+
+        loop = asyncio.get_running_loop()
+        saved = await loop.run_in_executor(self.executor, self.store.load, session_id)
+        #another turn may have loaded the session while this one waited on the store
+        if session_id in self.sessions or session_id in self.evicting:
+            return await self.get_session(session_id, strategy)
+        if saved is None:
+            session = self._new_session(session_id, strategy or self.default_strategy)
+            self.stats["created"] += 1
+        else:
+            #a stored session keeps the strategy it was created with
+            session = self._new_session(session_id, *saved)
+            self.stats["reloaded"] += 1
+        self.sessions[session_id] = session
+        session.active += 1
+        try:
+            await self.evict(max(0, len(self.sessions) - self.max_sessions), keep=session_id)
+        except BaseException:
+            session.active -= 1
+            raise
+        return session
+
+    async def evict(self, count=0, idle_before=None, keep=None):
+        #writes the count least recently used sessions, plus any idle since idle_before, to the store.
+        #sessions in the middle of a turn, and keep (the session being loaded), are never evicted
+        victims = []
+        for session in self.sessions.values():
+            if session.active or session.session_id == keep:
+                continue
+            if len(victims) < count or (idle_before is not None and session.last_used < idle_before):
+                victims.append(session)
+        if not victims:
+            return
+        for session in victims:
+            del self.sessions[session.session_id]
+            self.evicting[session.session_id] = session
+        try:
+            await self.persist(victims)
+        finally:
+            for session in victims:
+                if self.evicting.get(session.session_id) is session:
+                    del self.evicting[session.session_id]
+        self.stats["evicted"] += len(victims)
+
+    async def persist(self, sessions):
+        #memory is snapshotted before the write, so a turn landing during it marks the session dirty again
+        rows = [(session.session_id, session.strategy) + dump_memory(session.memory) for session in sessions if session.dirty]
+        for session in sessions:
+            session.dirty = False
+        if rows:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.store.save_many, rows)
+
+    async def chat(self, session_id, message, strategy=None):
+        session = await self.get_session(session_id, strategy)
+        try:
+            async with session.lock:
+                async with self.semaphore:
+                    loop = asyncio.get_running_loop()
+                    reply = await loop.run_in_executor(self.executor, lambda: session.conversation.predict(input=message))
+                session.last_used = time.monotonic()
+                session.dirty = True
+        finally:
+            session.active -= 1
+        self.stats["turns"] += 1
+        #sessions skipped by eviction while busy are evicted once their turn is done
+        if len(self.sessions) > self.max_sessions:
+            await self.evict(len(self.sessions) - self.max_sessions)
+        return reply
+
+    async def sweep_idle(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.idle_seconds / 2))
+            await self.evict(idle_before=time.monotonic() - self.idle_seconds)
+
+    async def handle_client(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                reply = await self.chat(str(request["session_id"]), request["message"], request.get("strategy"))
+                response = {"session_id": request["session_id"], "reply": reply}
+            except Exception as error:
+                response = {"error": str(error)}
+            writer.write((json.dumps(response) + "\n").encode())
+            await writer.drain()
+        writer.close()
+
+    async def close(self):
+        await self.persist(list(self.sessions.values()))
+        self.sessions.clear()
+        self.executor.shutdown(wait=True)
+        self.store.close()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        sweeper = asyncio.create_task(self.sweep_idle())
+        print(f"chat server listening on {host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            sweeper.cancel()
+            await self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--strategy", choices=STRATEGIES, default="buffer")
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    parser.add_argument("--idle-seconds", type=float, default=300)
+    parser.add_argument("--max-concurrency", type=int, default=64)
+    parser.add_argument("--db", default="chat_sessions.sqlite")
+    args = parser.parse_args()
+
+    load_dotenv()
+    configure_openai()
+
+    llm = get_chat_model(temperature=0)
+    server = ChatServer(llm, SessionStore(args.db), default_strategy=args.strategy, max_sessions=args.max_sessions,
+                        idle_seconds=args.idle_seconds, max_concurrency=args.max_concurrency)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,68 @@
+import os
+import sys
+from collections import deque
+
+from pydantic import PrivateAttr
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.schema import HumanMessage, AIMessage, get_buffer_string
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.tokens import default_token_counter
+
+
+class LocalTokenBufferMemory(BaseChatMemory):
+    # Drop-in for ConversationTokenBufferMemory that counts every message once, when it is added,
+    # and keeps a running total. Pruning pops the oldest messages off a deque, so a turn costs the
+    # same however long the conversation has been.
+
+    human_prefix: str = "Human"
+    ai_prefix: str = "AI"
+    memory_key: str = "history"
+    max_token_limit: int = 2000
+
+    _messages = PrivateAttr(default_factory=deque)
+    _total_tokens = PrivateAttr(default=0)
+
+    @property
+    def buffer(self):
+        return [message for message, _ in self._messages]
+
+    @property
+    def total_tokens(self):
+        return self._total_tokens
+
+    @property
+    def memory_variables(self):
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs):
+        if self.return_messages:
+            return {self.memory_key: self.buffer}
+        return {self.memory_key: get_buffer_string(self.buffer, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)}
+
+    def _add(self, message, prefix):
+        # Counted as the "<prefix>: <content>" line get_buffer_string renders, plus its newline
+        tokens = default_token_counter()(f"{prefix}: {message.content}") + 1
+        self._messages.append((message, tokens))
+        self._total_tokens += tokens
+
+    def save_context(self, inputs, outputs):
+        input_str, output_str = self._get_input_output(inputs, outputs)
+        self._add(HumanMessage(content=input_str), self.human_prefix)
+        self._add(AIMessage(content=output_str), self.ai_prefix)
+        self._prune()
+
+    def add_messages(self, messages):
+        # Restores saved history, pruned to the token limit like live turns
+        for message in messages:
+            self._add(message, self.human_prefix if isinstance(message, HumanMessage) else self.ai_prefix)
+        self._prune()
+
+    def _prune(self):
+        while self._total_tokens > self.max_token_limit and self._messages:
+            _, tokens = self._messages.popleft()
+            self._total_tokens -= tokens
+
+    def clear(self):
+        self._messages.clear()
+        self._total_tokens = 0
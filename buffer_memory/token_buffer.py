@@ -1,36 +1,44 @@
 import os
-import openai
+import sys
 from dotenv import load_dotenv
-from langchain.chat_models import ChatOpenAI
 from langchain.prompts import PromptTemplate
-from langchain.memory import ConversationTokenBufferMemory
 from langchain.chains import ConversationChain
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.clients import configure_openai, get_chat_model
+from common.streaming import stream_conversation
+from local_token_buffer import LocalTokenBufferMemory
+
 class ChatBot:
-    def __init__(self):
+    #streaming=True prints the reply token by token, with time to first token and total latency
+    def __init__(self, streaming=False):
         load_dotenv()
-        openai.api_type = "azure"
-        openai.api_version = "2023-05-15"
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-        openai.api_base = os.getenv("OPENAI_API_BASE")
+        configure_openai()
 
-        self.llm = ChatOpenAI(temperature=0, model_kwargs={"engine": "GPT3-5"})
-        self.memory = ConversationTokenBufferMemory(llm=self.llm, max_token_limit=100)
-        self.conversation = ConversationChain(llm=self.llm, memory=self.memory)
+        self.streaming = streaming
+        self.llm = get_chat_model(temperature=0)
+        #the reply llm streams, the memory keeps the non-streaming one
+        self.chat_llm = get_chat_model(temperature=0, streaming=True) if streaming else self.llm
+        #counts each message once with a local tokenizer instead of recounting the whole buffer every turn
+        self.memory = LocalTokenBufferMemory(max_token_limit=100)
+        self.conversation = ConversationChain(llm=self.chat_llm, memory=self.memory)
 
     def start(self):
         while True:
             message = input("Enter your message or type quit: ")
             if message.lower() == "quit":
                 break
-            result = self.conversation.predict(input=message)
-            print("result:", result)
+            if self.streaming:
+                stream_conversation(self.conversation, message)
+            else:
+                result = self.conversation.predict(input=message)
+                print("result:", result)
             
             print("\n*************************************")
             
 
 if __name__ == "__main__":
-    chatbot = ChatBot()
+    chatbot = ChatBot(streaming="--stream" in sys.argv)
     chatbot.start()
     print(chatbot.memory.buffer)
 
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import glob
+import random
+import asyncio
+import argparse
+import statistics
+from collections import defaultdict
+
+from openai.error import RateLimitError
+
+from main import AIInterface, FactExtractionChain, InvestorUpdateChain
+
+STAGES = ("facts", "investor_update")
+
+
+#runs FactExtractionChain -> InvestorUpdateChain over many articles. every article moves to its
+#investor update as soon as its facts are ready, so both stages are busy at once. llm calls share an
+#adaptive concurrency limit that halves on rate limiting and creeps back up on success. each finished
+#stage is appended to a jsonl checkpoint, and a rerun skips whatever the checkpoint already holds.
+
+def iter_articles(source):
+    #yields (article id, text) from a .jsonl file ({"id", "text"} per line) or a directory of .txt/.md files
+    if os.path.isdir(source):
+        for path in sorted(glob.glob(os.path.join(source, "*.txt")) + glob.glob(os.path.join(source, "*.md"))):
+            with open(path, "r", encoding="utf-8") as file:
+                yield os.path.basename(path), file.read()
+        return
+    with open(source, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            if line.strip():
+                record = json.loads(line)
+                yield str(record.get("id", line_number)), record["text"]
+
+
+def load_checkpoint(path):
+    #{article id: {stage: output}} of every stage already finished
+    done = defaultdict(dict)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    #a line torn by a crash mid-write is simply redone
+                    continue
+                done[record["id"]][record["stage"]] = record["output"]
+    return done
+
+
+class AdaptiveLimiter:
+    #concurrency limit for llm calls: halved on every rate limit error, raised by one after
+    #`increase_after` successes in a row, never above max_concurrency
+    def __init__(self, max_concurrency=8, min_concurrency=1, increase_after=10):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.increase_after = increase_after
+        self.limit = max_concurrency
+        self.in_flight = 0
+        self.successes = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, rate_limited=False):
+        async with self.condition:
+            self.in_flight -= 1
+            if rate_limited:
+                self.limit = max(self.min_concurrency, self.limit // 2)
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.successes >= self.increase_after and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+
+class StageStats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.retries = defaultdict(int)
+        self.start = time.perf_counter()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        report = {"elapsed_seconds": round(elapsed, 3)}
+        for stage in STAGES:
+            latencies = sorted(self.latencies[stage])
+            report[stage] = {
+                "completed": len(latencies),
+                "errors": self.errors[stage],
+                "rate_limit_retries": self.retries[stage],
+                "per_second": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+                "p50_seconds": round(statistics.median(latencies), 3) if latencies else None,
+                "p95_seconds": round(latencies[int(0.95 * (len(latencies) - 1))], 3) if latencies else None,
+            }
+        return report
+
+
+class BatchRunner:
+    def __init__(self, llm, checkpoint_path="output/investor_updates.jsonl", max_concurrency=8, max_in_flight=None, max_retries=5, backoff=1.0, timeout=120):
+        self.fact_extraction = FactExtractionChain(llm)
+        self.investor_update = InvestorUpdateChain(llm)
+        self.checkpoint_path = checkpoint_path
+        self.max_concurrency = max_concurrency
+        #articles read ahead of the llm calls; bounds memory however large the source is
+        self.max_in_flight = max_in_flight or 4 * max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.stats = None
+
+    async def call(self, stage, fn, text):
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            start = time.perf_counter()
+            worker = asyncio.ensure_future(asyncio.to_thread(fn, text))
+            try:
+                result = await asyncio.wait_for(asyncio.shield(worker), self.timeout)
+                self.stats.latencies[stage].append(time.perf_counter() - start)
+                return result
+            except RateLimitError:
+                if attempt == self.max_retries:
+                    raise
+                self.stats.retries[stage] += 1
+            finally:
+                if worker.done():
+                    await self.limiter.release(self.rate_limited(worker))
+                else:
+                    #a timed out call cannot stop its thread, so its slot stays taken until the thread is done
+                    task = asyncio.ensure_future(self.release_when_done(worker))
+                    self.releases.add(task)
+                    task.add_done_callback(self.releases.discard)
+            await asyncio.sleep(self.backoff * 2 ** attempt + random.uniform(0, self.backoff))
+
+    @staticmethod
+    def rate_limited(worker):
+        return not worker.cancelled() and isinstance(worker.exception(), RateLimitError)
+
+    async def release_when_done(self, worker):
+        await asyncio.wait([worker])
+        await self.limiter.release(self.rate_limited(worker))
+
+    def write(self, article_id, stage, output):
+        #one line per finished stage, flushed so a crash loses at most the calls in flight
+        self.checkpoint.write(json.dumps({"id": article_id, "stage": stage, "output": output}) + "\n")
+        self.checkpoint.flush()
+
+    async def process(self, article_id, text, done):
+        stage = "facts"
+        try:
+            facts = done.get("facts")
+            if facts is None:
+                facts = await self.call(stage, self.fact_extraction.run, text)
+                self.write(article_id, stage, facts)
+            stage = "investor_update"
+            update = await self.call(stage, self.investor_update.run, facts)
+            self.write(article_id, stage, update)
+        except Exception as error:
+            self.stats.errors[stage] += 1
+            print(f"{article_id}: {stage} failed: {error!r}")
+
+    async def run(self, articles):
+        #articles is an iterable of (article id, text); returns the per-stage statistics
+        self.limiter = AdaptiveLimiter(self.max_concurrency)
+        #slot releases of timed out calls, each waiting on its worker thread
+        self.releases = set()
+        self.stats = StageStats()
+        checkpointed = load_checkpoint(self.checkpoint_path)
+        os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+
+        slots = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+
+        async def run_article(article_id, text, done):
+            try:
+                await self.process(article_id, text, done)
+            finally:
+                slots.release()
+
+        with open(self.checkpoint_path, "a", encoding="utf-8") as self.checkpoint:
+            for article_id, text in articles:
+                done = checkpointed.get(article_id, {})
+                if "investor_update" in done:
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(run_article(article_id, text, done))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        #threads of timed out calls may still be running
+        if self.releases:
+            await asyncio.gather(*self.releases)
+
+        return self.stats.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="articles as a .jsonl file or a directory of .txt/.md files")
+    parser.add_argument("--checkpoint", default="output/investor_updates.jsonl")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    runner = BatchRunner(AIInterface().llm, checkpoint_path=args.checkpoint, max_concurrency=args.max_concurrency)
+    print(json.dumps(asyncio.run(runner.run(iter_articles(args.source))), indent=2))
@@ -0,0 +1,65 @@
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain.llms.fake import FakeListLLM
+from langchain_experimental.pal_chain import PALChain
+
+from pal_sandbox import PALSandbox, SandboxedPALChain
+
+
+#throughput and latency of PALChain's in-process execution against SandboxedPALChain, offline.
+#a fake llm returns canned PAL programs, so only program execution and its setup are measured. the
+#fake llm repeats the same few programs, so the sandbox comparison runs with its result cache off;
+#the cached run is reported separately, with its cache hits.
+
+PROGRAMS = [
+    "def solution():\n    apples_initial = 23\n    apples_used = 20\n    apples_bought = 6\n    result = apples_initial - apples_used + apples_bought\n    return result",
+    "def solution():\n    apples_mary = 4\n    boxes = 2.5\n    apples_per_box = 8\n    result = apples_mary + boxes * apples_per_box\n    return result",
+    "def solution():\n    speed = 4.5 * 2.1\n    result = speed ** 2.2\n    return result",
+    "def solution():\n    total = 0\n    for day in range(1, 31):\n        total += day * 3\n    result = total\n    return result",
+]
+
+
+def summarize(latencies, elapsed):
+    return {
+        "questions": len(latencies),
+        "per_second": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(1000 * statistics.median(latencies), 2),
+        "p95_ms": round(1000 * sorted(latencies)[int(0.95 * (len(latencies) - 1))], 2),
+    }
+
+
+def bench_in_process(questions):
+    chain = PALChain.from_math_prompt(FakeListLLM(responses=PROGRAMS))
+    latencies = []
+    start = time.perf_counter()
+    for question in questions:
+        question_start = time.perf_counter()
+        chain.run(question)
+        latencies.append(time.perf_counter() - question_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def bench_sandbox(questions, processes=4, max_concurrency=8, cache_results=False):
+    with PALSandbox(processes=processes, cache_results=cache_results) as sandbox:
+        chain = SandboxedPALChain(PALChain.from_math_prompt(FakeListLLM(responses=PROGRAMS)), sandbox)
+
+        def timed_run(question):
+            question_start = time.perf_counter()
+            chain.run(question)
+            return time.perf_counter() - question_start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            latencies = list(executor.map(timed_run, questions))
+        report = summarize(latencies, time.perf_counter() - start)
+        report.update(sandbox.stats)
+    return report
+
+
+if __name__ == "__main__":
+    questions = [f"word problem {i}" for i in range(200)]
+    print("in-process", bench_in_process(questions))
+    print("sandbox   ", bench_sandbox(questions))
+    print("sandbox, result cache", bench_sandbox(questions, cache_results=True))
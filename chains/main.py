@@ -1,20 +1,23 @@
 import os
-import openai
+import sys
 from dotenv import load_dotenv
-from langchain.llms import OpenAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain, SimpleSequentialChain, SequentialChain
 from langchain_experimental.pal_chain import PALChain
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.clients import configure_openai, get_llm
+from common.llm_cache import install_llm_cache
+from pal_sandbox import PALSandbox, SandboxedPALChain
+
 class AIInterface:
     def __init__(self):
         load_dotenv()
-        openai.api_type = "azure"
-        openai.api_version = "2023-05-15"
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-        openai.api_base = os.getenv("OPENAI_API_BASE")
+        configure_openai()
+        # Temperature-0 prompts seen before are answered from disk by every chain built on this llm
+        self.llm_cache = install_llm_cache()
 
-        self.llm = OpenAI(temperature=0, model_kwargs={"engine": "GPT3-5"})
+        self.llm = get_llm(temperature=0)
 
 class FactExtractionChain:
     def __init__(self, llm):
@@ -52,13 +55,23 @@ class FullSeqChain:
       
 
 class PALChainWrapper:
-    def __init__(self, llm):
+    #sandbox is an optional PALSandbox: generated programs then run in its worker processes with
+    #cpu, memory and time limits instead of in this interpreter
+    def __init__(self, llm, sandbox=None):
         self.pal_chain = PALChain.from_math_prompt(llm, verbose=True)
+        self.sandboxed_chain = SandboxedPALChain(self.pal_chain, sandbox) if sandbox is not None else None
     
     def run(self, question):
+        if self.sandboxed_chain is not None:
+            return self.sandboxed_chain.run(question)
         pal_result = self.pal_chain.run(question)
         return pal_result
 
+    def run_many(self, questions, max_concurrency=8):
+        if self.sandboxed_chain is not None:
+            return self.sandboxed_chain.run_many(questions, max_concurrency)
+        return [self.run(question) for question in questions]
+
 if __name__ == "__main__":
     ai_interface = AIInterface()
 
@@ -77,9 +90,12 @@ if __name__ == "__main__":
     
     # print(response)
 
-    pal_chain_wrapper = PALChainWrapper(ai_interface.llm)
     question_02 = "The cafeteria had 23 apples. If they used 20 for lunch and bought 6 more, how many apples do they have?"
 
-    pal_result = pal_chain_wrapper.run(question_02)
+    with PALSandbox() as sandbox:
+        pal_chain_wrapper = PALChainWrapper(ai_interface.llm, sandbox=sandbox)
+        pal_result = pal_chain_wrapper.run(question_02)
 
     # print(pal_result)
+
+    print(ai_interface.llm_cache.metrics())
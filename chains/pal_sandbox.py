@@ -0,0 +1,222 @@
+import time
+import signal
+import marshal
+import hashlib
+import builtins
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#runs PAL programs (python written by the llm) in a pool of pre-warmed worker processes instead of
+#exec'ing them in the caller. every program gets a cpu-time limit, a wall-clock timeout, an address
+#space limit and builtins without file, exec or import access beyond a few math modules. programs
+#are compiled once per code hash, and results of programs already run are reused.
+
+ALLOWED_MODULES = {"math", "fractions", "decimal", "datetime", "statistics"}
+BLOCKED_BUILTINS = {"open", "exec", "eval", "compile", "input", "breakpoint", "exit", "quit", "help", "globals", "locals", "vars", "memoryview"}
+
+_worker_compiled = OrderedDict()
+_worker_limits = None
+
+
+class ProgramTimeout(Exception):
+    pass
+
+
+def _on_limit(signum, frame):
+    raise ProgramTimeout("cpu time limit exceeded" if signum == getattr(signal, "SIGXCPU", None) else "timed out")
+
+
+def _safe_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if name.split(".")[0] not in ALLOWED_MODULES:
+        raise ImportError(f"import of {name} is not allowed")
+    return __import__(name, globals, locals, fromlist, level)
+
+
+SAFE_BUILTINS = {name: value for name, value in vars(builtins).items() if name not in BLOCKED_BUILTINS}
+SAFE_BUILTINS["__import__"] = _safe_import
+
+
+def _address_space():
+    # Bytes of virtual memory the worker already maps (inherited from the parent when forked)
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError):
+        return 0
+
+
+def _init_worker(cpu_seconds, memory_bytes, timeout):
+    # Runs once per worker: limits, signal handlers and the allowed modules are set up before any program
+    global _worker_limits
+    _worker_limits = (cpu_seconds, timeout)
+    signal.signal(signal.SIGALRM, _on_limit)
+    if resource is not None:
+        signal.signal(signal.SIGXCPU, _on_limit)
+        if memory_bytes:
+            # memory_bytes on top of what the worker maps before running any program
+            limit = _address_space() + memory_bytes
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    for module in ALLOWED_MODULES:
+        __import__(module)
+
+
+def _run_program(code_hash, code_bytes, answer_expr):
+    # (True, answer) or (False, error message); never raises, so a bad program cannot break the pool
+    cpu_seconds, timeout = _worker_limits
+    code = _worker_compiled.get(code_hash)
+    if code is None:
+        code = marshal.loads(code_bytes)
+        _worker_compiled[code_hash] = code
+        if len(_worker_compiled) > 1024:
+            _worker_compiled.popitem(last=False)
+
+    if resource is not None and cpu_seconds:
+        # RLIMIT_CPU counts the whole life of the process, so the limit is moved past the time used so far
+        used = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(used.ru_utime + used.ru_stime + cpu_seconds) + 1
+        hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+        resource.setrlimit(resource.RLIMIT_CPU, (soft if hard == resource.RLIM_INFINITY else min(soft, hard), hard))
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        namespace = {"__builtins__": SAFE_BUILTINS, "__name__": "pal_program"}
+        exec(code, namespace)
+        return True, str(eval(answer_expr, namespace))
+    except ProgramTimeout as error:
+        return False, str(error)
+    except BaseException as error:
+        return False, f"{type(error).__name__}: {error}"
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class PALSandbox:
+    #cache_results=False runs every program even when the same one already ran, e.g. to time execution
+    def __init__(self, processes=None, cpu_seconds=2, memory_mb=256, timeout=5.0, cache_size=4096, cache_results=True):
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.cache_results = cache_results
+        self.pool = multiprocessing.get_context("fork" if hasattr(signal, "SIGALRM") else "spawn").Pool(
+            processes, initializer=_init_worker, initargs=(cpu_seconds, memory_mb * 1024 * 1024 if memory_mb else None, timeout))
+        self.compiled = OrderedDict()
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"runs": 0, "compile_cache_hits": 0, "result_cache_hits": 0, "errors": 0}
+
+    def _remember(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _compile(self, code):
+        # marshalled code object for a program, compiled in this process once per code hash
+        code_hash = hashlib.sha256(code.encode("utf-8")).hexdigest()
+        with self.lock:
+            if code_hash in self.compiled:
+                self.stats["compile_cache_hits"] += 1
+                self.compiled.move_to_end(code_hash)
+                return code_hash, self.compiled[code_hash]
+        code_bytes = marshal.dumps(compile(code, "<pal>", "exec"))
+        with self.lock:
+            self._remember(self.compiled, code_hash, code_bytes)
+        return code_hash, code_bytes
+
+    def submit(self, code, answer_expr="solution()"):
+        # Returns a callable that waits for (ok, answer or error)
+        try:
+            code_hash, code_bytes = self._compile(code)
+        except SyntaxError as error:
+            with self.lock:
+                self.stats["errors"] += 1
+            result = (False, f"SyntaxError: {error}")
+            return lambda: result
+
+        key = (code_hash, answer_expr)
+        with self.lock:
+            self.stats["runs"] += 1
+            if self.cache_results and key in self.results:
+                self.stats["result_cache_hits"] += 1
+                result = self.results[key]
+                return lambda: result
+
+        pending = self.pool.apply_async(_run_program, (code_hash, code_bytes, answer_expr))
+
+        def wait():
+            try:
+                # Workers stop programs themselves; this only catches a worker that died
+                result = pending.get(self.timeout + 5)
+            except multiprocessing.TimeoutError:
+                result = (False, "worker did not answer")
+            with self.lock:
+                if result[0]:
+                    if self.cache_results:
+                        self._remember(self.results, key, result)
+                else:
+                    self.stats["errors"] += 1
+            return result
+
+        return wait
+
+    def run(self, code, answer_expr="solution()"):
+        return self.submit(code, answer_expr)()
+
+    def run_many(self, codes, answer_expr="solution()"):
+        waits = [self.submit(code, answer_expr) for code in codes]
+        return [wait() for wait in waits]
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SandboxedPALChain:
+    # PALChain's prompt and llm, with the generated program run in a PALSandbox
+    def __init__(self, pal_chain, sandbox, answer_expr="solution()"):
+        self.pal_chain = pal_chain
+        self.sandbox = sandbox
+        self.answer_expr = answer_expr
+        self.timings = {"generate": [], "execute": []}
+
+    def generate(self, question):
+        start = time.perf_counter()
+        code = self.pal_chain.llm_chain.predict(question=question, stop=[self.pal_chain.stop])
+        self.timings["generate"].append(time.perf_counter() - start)
+        return code
+
+    def _execute(self, code):
+        start = time.perf_counter()
+        ok, answer = self.sandbox.run(code, self.answer_expr)
+        self.timings["execute"].append(time.perf_counter() - start)
+        return answer if ok else f"Error: {answer}"
+
+    def run(self, question):
+        code = self.generate(question)
+        # The wrapped chain's checks (no imports or exec, a solution() function) run first, and raise
+        # ValueError like PALChain does; the sandbox only limits what passes them
+        type(self.pal_chain).validate_code(code, self.pal_chain.code_validations)
+        return self._execute(code)
+
+    def _run_or_error(self, question):
+        try:
+            return self.run(question)
+        except Exception as error:
+            return f"Error: {type(error).__name__}: {error}"
+
+    def run_many(self, questions, max_concurrency=8):
+        # Programs are generated concurrently and each one runs as soon as it is written; answers keep question order.
+        # A question that fails (e.g. its program does not pass validation) gets "Error: ..." in its slot
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            return list(executor.map(self._run_or_error, questions))
@@ -0,0 +1,121 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+
+import numpy as np
+
+from common.hashing import document_key
+
+# Relative to the working directory, like each pipeline's faiss_index/ and output/
+DEFAULT_CACHE_PATH = ".answer_cache.sqlite"
+
+
+def normalize_question(question):
+    # Case, whitespace and trailing punctuation do not change the meaning of a question
+    question = re.sub(r"\s+", " ", question.lower()).strip()
+    return question.strip(" ?!.")
+
+
+def context_key(docs):
+    # Retrieval order does not matter to the stuff/refine prompts, only the set of chunks
+    return hashlib.sha256("\n".join(sorted(document_key(doc) for doc in docs)).encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    # On-disk cache of LLM answers keyed on a normalised question plus the ids of the chunks that
+    # were retrieved for it. With an embedding model, near-duplicate questions over the same chunks
+    # also hit when their cosine similarity reaches similarity_threshold. Entries expire after
+    # ttl_seconds and the least recently used ones are evicted beyond max_entries. lookup only reads
+    # (plus the last_used update of a hit); expired rows are skipped there and deleted by store.
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, embeddings=None, similarity_threshold=0.95, ttl_seconds=7 * 24 * 3600, max_entries=10000):
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS answers (
+            key TEXT PRIMARY KEY,
+            context_key TEXT NOT NULL,
+            question TEXT NOT NULL,
+            vector BLOB,
+            answer TEXT NOT NULL,
+            created REAL NOT NULL,
+            last_used REAL NOT NULL)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS answers_context ON answers (context_key)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS answers_created ON answers (created)")
+        self.conn.commit()
+
+    def _vector(self, question):
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _key(self, ctx_key, question):
+        return hashlib.sha256(f"{ctx_key}\0{question}".encode("utf-8")).hexdigest()
+
+    def lookup(self, question, docs):
+        question = normalize_question(question)
+        ctx_key = context_key(docs)
+        now = time.time()
+
+        expired = now - self.ttl_seconds
+
+        with self.lock:
+            row = self.conn.execute("SELECT key, answer FROM answers WHERE key = ? AND created >= ?", (self._key(ctx_key, question), expired)).fetchone()
+            candidates = []
+            if row is None and self.embeddings is not None and self.similarity_threshold < 1.0:
+                candidates = self.conn.execute(
+                    "SELECT key, answer, vector FROM answers WHERE context_key = ? AND vector IS NOT NULL AND created >= ?", (ctx_key, expired)).fetchall()
+
+        if candidates:
+            # Near-duplicate match among answers given for the same retrieved chunks
+            vector = self._vector(question)
+            scores = [float(np.frombuffer(blob, dtype=np.float32) @ vector) for _, _, blob in candidates]
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity_threshold:
+                row = candidates[best][:2]
+
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, row[0]))
+            self.conn.commit()
+            return row[1]
+
+    def store(self, question, docs, answer):
+        question = normalize_question(question)
+        ctx_key = context_key(docs)
+        vector = self._vector(question).tobytes() if self.embeddings is not None else None
+        now = time.time()
+
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO answers (key, context_key, question, vector, answer, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._key(ctx_key, question), ctx_key, question, vector, answer, now, now))
+            self.conn.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl_seconds,))
+            # LRU eviction down to max_entries
+            self.conn.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM answers")
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
@@ -0,0 +1,139 @@
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+#process-wide factory for the clients every pipeline uses. each client is built when it is first
+#asked for and then reused: one azure openai configuration with a pooled keep-alive http session, one
+#ChatOpenAI / OpenAI per distinct setting and one SentenceTransformer per model name. the pipelines
+#import langchain at module top anyway, so the only import this defers that matters for start-up is
+#sentence_transformers (and torch). timings holds the seconds spent on each import, construction
+#and the first request.
+
+AZURE_API_VERSION = "2023-05-15"
+DEFAULT_ENGINE = "GPT3-5"
+
+timings = {}
+
+_lock = threading.RLock()
+_configured = False
+_session = None
+_clients = {}
+
+
+@contextmanager
+def timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def http_session(pool_size=32):
+    # One requests session for all openai calls of the process, so TLS connections to the azure
+    # endpoint are kept alive and reused instead of being set up per thread
+    global _session
+    with _lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+
+            def note_first_response(response, *args, **kwargs):
+                timings.setdefault("first_request", response.elapsed.total_seconds())
+            session.hooks["response"].append(note_first_response)
+            _session = session
+        return _session
+
+
+def configure_openai(api_key=None, api_base=None):
+    # Azure settings on the openai module. Safe to call from every constructor: after the first
+    # call it only applies explicitly passed values
+    global _configured
+    with _lock:
+        if _configured and api_key is None and api_base is None:
+            return
+        with timed("import:openai"):
+            import openai
+        openai.api_type = "azure"
+        openai.api_version = AZURE_API_VERSION
+        openai.api_key = api_key or openai.api_key or os.getenv("OPENAI_API_KEY")
+        openai.api_base = api_base or (openai.api_base if _configured else os.getenv("OPENAI_API_BASE"))
+        openai.requestssession = http_session()
+        _configured = True
+
+
+def _cached(key, build):
+    with _lock:
+        if key not in _clients:
+            with timed(f"build:{key[0]}"):
+                _clients[key] = build()
+        return _clients[key]
+
+
+def _normalize(value):
+    # temperature=0 and temperature=0.0 are the same setting; bools stay bools
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def _key(kind, **settings):
+    return (kind,) + tuple(sorted((name, repr(_normalize(value))) for name, value in settings.items()))
+
+
+def get_chat_model(temperature=0.0, streaming=False, engine=DEFAULT_ENGINE, **kwargs):
+    # Shared ChatOpenAI for the given settings; extra kwargs (headers, tags, ...) are passed through
+    configure_openai()
+
+    def build():
+        with timed("import:langchain.chat_models"):
+            from langchain.chat_models import ChatOpenAI
+        return ChatOpenAI(temperature=temperature, streaming=streaming, model_kwargs={"engine": engine}, **kwargs)
+
+    return _cached(_key("chat_model", temperature=temperature, streaming=streaming, engine=engine, **kwargs), build)
+
+
+def get_llm(temperature=0.0, engine=DEFAULT_ENGINE, **kwargs):
+    # Shared completion-style OpenAI llm for the given settings
+    configure_openai()
+
+    def build():
+        with timed("import:langchain.llms"):
+            from langchain.llms import OpenAI
+        return OpenAI(temperature=temperature, model_kwargs={"engine": engine}, **kwargs)
+
+    return _cached(_key("llm", temperature=temperature, engine=engine, **kwargs), build)
+
+
+def get_sentence_transformer(model_name="all-MiniLM-L6-v2"):
+    # Loading a sentence transformer costs seconds and hundreds of MB, so each process loads a model once
+    def build():
+        with timed("import:sentence_transformers"):
+            from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+
+    return _cached(_key("sentence_transformer", model_name=model_name), build)
+
+
+if __name__ == "__main__":
+    # Cold start report: python common/clients.py [--request]
+    # --request also times one chat completion against the configured azure endpoint
+    from dotenv import load_dotenv
+
+    start = time.perf_counter()
+    load_dotenv()
+    get_chat_model()
+    get_sentence_transformer().encode(["warm up"])
+    if "--request" in sys.argv:
+        with timed("request:chat"):
+            get_chat_model().predict("Say hello.")
+    timings["total"] = time.perf_counter() - start
+    for name, seconds in timings.items():
+        print(f"{name:40s} {seconds:8.3f}s")
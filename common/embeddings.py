@@ -0,0 +1,195 @@
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from common.clients import get_sentence_transformer
+from common.tracing import stage
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Relative to the working directory, like each pipeline's faiss_index/ and output/
+DEFAULT_CACHE_DIR = ".embedding_cache"
+
+_worker_model = None
+
+
+def _init_worker(model_name, threads_per_worker):
+    # Each worker process loads its own copy of the model once
+    global _worker_model
+    import torch
+
+    torch.set_num_threads(threads_per_worker)
+    _worker_model = get_sentence_transformer(model_name)
+
+
+def _encode_batch(texts, batch_size, normalize):
+    return _worker_model.encode(texts, batch_size=batch_size, normalize_embeddings=normalize, convert_to_numpy=True, show_progress_bar=False).astype(np.float32)
+
+
+def text_key(model_name, text):
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class _FileLock:
+    # Cross-process lock around appends to the vector file (no-op where fcntl is missing)
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+class EmbeddingCache:
+    # Persistent text-hash -> float32 vector store. Vectors are appended to one flat file that
+    # is read through a memory map; a small sqlite table maps each hash to its row.
+
+    def __init__(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(cache_dir, "vectors.f32")
+        self.lock_path = os.path.join(cache_dir, "vectors.lock")
+        self.conn = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS rows (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.dim = self._read_dim()
+        self._mmap = None
+
+    def _read_dim(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+        return int(row[0]) if row else None
+
+    def _vectors(self, min_rows):
+        # Re-map the vector file when another writer has grown it past the current view
+        if self._mmap is None or self._mmap.shape[0] < min_rows:
+            rows = os.path.getsize(self.vectors_path) // (self.dim * 4)
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return self._mmap
+
+    def get_many(self, keys):
+        if self.dim is None:
+            self.dim = self._read_dim()
+        if self.dim is None or not keys:
+            return {}
+
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                found.update(self.conn.execute(f"SELECT key, row FROM rows WHERE key IN ({placeholders})", batch).fetchall())
+
+        if not found:
+            return {}
+        vectors = self._vectors(max(found.values()) + 1)
+        return {key: np.array(vectors[row]) for key, row in found.items()}
+
+    def put_many(self, keys, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not keys:
+            return
+
+        with self.lock, _FileLock(self.lock_path):
+            if self.dim is None:
+                self.dim = self._read_dim() or vectors.shape[1]
+                self.conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('dim', ?)", (str(self.dim),))
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match cache dimension {self.dim}")
+
+            row_bytes = self.dim * 4
+            with open(self.vectors_path, "ab") as file:
+                size = file.tell()
+                if size % row_bytes:
+                    # Drop a torn row left behind by a crashed writer
+                    file.truncate(size - size % row_bytes)
+                    size -= size % row_bytes
+                file.write(vectors.tobytes())
+
+            # Rows are committed only after their vectors hit the file, so readers never see a dangling row
+            first_row = size // row_bytes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO rows (key, row) VALUES (?, ?)",
+                [(key, first_row + i) for i, key in enumerate(keys)])
+            self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    # Sentence-transformer embeddings computed in tunable CPU batches, optionally across several
+    # worker processes, and memoised in an EmbeddingCache shared by every pipeline and run.
+
+    def __init__(self, model_name="all-MiniLM-L6-v2", batch_size=64, num_workers=1, normalize=False, cache_dir=DEFAULT_CACHE_DIR):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.normalize = normalize
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name) + ("-normalized" if normalize else "")
+        self.cache = EmbeddingCache(os.path.join(cache_dir, safe_name))
+        self._model = None
+
+    @property
+    def model(self):
+        # The model is only loaded when something actually misses the cache, and shared by the process
+        if self._model is None:
+            self._model = get_sentence_transformer(self.model_name)
+        return self._model
+
+    def _batches(self, texts):
+        for start in range(0, len(texts), self.batch_size):
+            yield texts[start:start + self.batch_size]
+
+    def _compute(self, keys, texts):
+        # Embed cache misses batch by batch, persisting each batch as soon as it is ready
+        if self.num_workers > 1 and len(texts) > self.batch_size:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // self.num_workers)
+            with ProcessPoolExecutor(max_workers=self.num_workers, initializer=_init_worker, initargs=(self.model_name, threads_per_worker)) as executor:
+                results = executor.map(_encode_batch, self._batches(texts), repeat(self.batch_size), repeat(self.normalize))
+                for start, vectors in zip(range(0, len(texts), self.batch_size), results):
+                    self.cache.put_many(keys[start:start + self.batch_size], vectors)
+            return
+
+        for start, batch in zip(range(0, len(texts), self.batch_size), self._batches(texts)):
+            vectors = self.model.encode(batch, batch_size=self.batch_size, normalize_embeddings=self.normalize, convert_to_numpy=True, show_progress_bar=False)
+            self.cache.put_many(keys[start:start + self.batch_size], vectors)
+
+    def embed_documents(self, texts):
+        with stage("embed", texts=len(texts)) as record:
+            keys = [text_key(self.model_name, text) for text in texts]
+            found = self.cache.get_many(list(set(keys)))
+
+            # Each distinct missing text is embedded exactly once
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in found and key not in missing:
+                    missing[key] = text
+            if missing:
+                self._compute(list(missing.keys()), list(missing.values()))
+                found.update(self.cache.get_many(list(missing.keys())))
+            record["computed"] = len(missing)
+
+            return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
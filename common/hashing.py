@@ -0,0 +1,49 @@
+import os
+import hashlib
+
+
+def source_path(source):
+    # Path of a chunk's file relative to the working directory, with / separators, so ./input/a.pdf and
+    # input/a.pdf agree while input/2023/a.pdf and input/2024/a.pdf stay apart
+    if not source:
+        return ""
+    return os.path.relpath(str(source)).replace(os.sep, "/")
+
+
+def chunk_id(source, text, occurrence=0):
+    # Content id of a chunk: the path of its file, its text, and which occurrence of that text in the
+    # file it is, so repeated chunks (e.g. page headers) of one file are kept apart
+    digest = hashlib.sha256()
+    digest.update(source_path(source).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(str(occurrence).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def assign_chunk_ids(docs, seen=None):
+    # One chunk_id per chunk, stable across rebuilds of the same file. For a stream of chunks split
+    # into batches (or handled one by one), pass the same seen dict every time
+    seen = {} if seen is None else seen
+    ids = []
+    for doc in docs:
+        key = (source_path(doc.metadata.get("source", "")), doc.page_content)
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        ids.append(chunk_id(key[0], key[1], occurrence))
+    return ids
+
+
+def document_key(doc):
+    # Id of a chunk's content regardless of repeats, e.g. for keying caches on a set of retrieved chunks
+    return chunk_id(doc.metadata.get("source", ""), doc.page_content)
+
+
+def file_hash(path, block_size=1 << 20):
+    # Hash of the raw bytes of a file, so derived data (parsed text, chunks) can be cached per version
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,118 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+
+import langchain
+from langchain.cache import BaseCache
+from langchain.load.dump import dumps
+from langchain.load.load import loads
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, ".llm_cache.sqlite")
+
+TEMPERATURE_PATTERN = re.compile(r"\('temperature', ([0-9.eE+-]+)\)")
+
+
+def is_deterministic(llm_string):
+    # llm_string is langchain's sorted (name, value) list of the model parameters; only
+    # temperature-0 calls return the same completion for the same prompt
+    match = TEMPERATURE_PATTERN.search(llm_string)
+    return match is not None and float(match.group(1)) == 0.0
+
+
+class BoundedSQLiteCache(BaseCache):
+    # Prompt-level langchain llm cache on disk. Entries are keyed on the llm string (model, engine,
+    # parameters, stop words) and the rendered prompt, and only temperature-0 calls are cached.
+    # The least recently used entries are evicted beyond max_entries or max_bytes of generations.
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=50000, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS generations (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            last_used REAL NOT NULL)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used)")
+        self.conn.commit()
+
+    def _key(self, prompt, llm_string):
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt, llm_string):
+        if not is_deterministic(llm_string):
+            with self.lock:
+                self.skipped += 1
+            return None
+
+        key = self._key(prompt, llm_string)
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE generations SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+        return loads(row[0])
+
+    def update(self, prompt, llm_string, return_val):
+        if not is_deterministic(llm_string):
+            return
+        value = dumps(return_val)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?)",
+                (self._key(prompt, llm_string), value, len(value), time.time()))
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        self.conn.execute(
+            "DELETE FROM generations WHERE key IN (SELECT key FROM generations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,))
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Oldest first until the generations fit into max_bytes again
+        evict = []
+        for key, size in self.conn.execute("SELECT key, size FROM generations ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            evict.append((key,))
+            total -= size
+        self.conn.executemany("DELETE FROM generations WHERE key = ?", evict)
+
+    def clear(self, **kwargs):
+        with self.lock:
+            self.conn.execute("DELETE FROM generations")
+            self.conn.commit()
+
+    def metrics(self):
+        with self.lock:
+            entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generations").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "skipped_nondeterministic": self.skipped,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "bytes": size,
+            }
+
+
+def install_llm_cache(path=DEFAULT_CACHE_PATH, **kwargs):
+    # Sets the process-wide langchain.llm_cache, so every LLM and chat model call goes through it.
+    # Repeated calls keep the cache that is already installed
+    if not isinstance(langchain.llm_cache, BoundedSQLiteCache):
+        langchain.llm_cache = BoundedSQLiteCache(path, **kwargs)
+    return langchain.llm_cache
@@ -0,0 +1,61 @@
+import os
+import glob
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain.document_loaders import PyPDFLoader
+
+
+def load_and_split(file_path, text_splitter):
+    # Runs inside a worker process: parse a single PDF and split its pages into chunks.
+    # Splitters with split_file (StructuredTextSplitter) reuse the cached parse of the PDF instead
+    if hasattr(text_splitter, "split_file"):
+        return text_splitter.split_file(file_path)
+    pages = PyPDFLoader(file_path).load()
+    return text_splitter.split_documents(pages)
+
+
+class ParallelPDFLoader:
+    # Parses PDFs in a process pool and yields split chunks as soon as each file is done.
+    # At most `prefetch` files are in flight, so peak memory follows the worker count
+    # instead of the corpus size.
+
+    def __init__(self, file_paths, text_splitter, max_workers=None, prefetch=None):
+        self.file_paths = list(file_paths)
+        self.text_splitter = text_splitter
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.prefetch = prefetch or self.max_workers * 2
+
+    @classmethod
+    def from_directory(cls, dir_path, text_splitter, glob_pattern="*.pdf", recursive=False, **kwargs):
+        file_paths = sorted(glob.glob(os.path.join(dir_path, glob_pattern), recursive=recursive))
+        return cls(file_paths, text_splitter, **kwargs)
+
+    def lazy_load(self):
+        # Generator of chunks in file order; embedding can start while later files still parse
+        if self.max_workers == 1 or len(self.file_paths) <= 1:
+            for file_path in self.file_paths:
+                yield from load_and_split(file_path, self.text_splitter)
+            return
+
+        workers = min(self.max_workers, len(self.file_paths))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            paths = iter(self.file_paths)
+
+            for file_path in paths:
+                pending.append(executor.submit(load_and_split, file_path, self.text_splitter))
+                if len(pending) >= self.prefetch:
+                    break
+
+            while pending:
+                chunks = pending.popleft().result()
+                # Keep the window full before handing chunks to the consumer
+                next_path = next(paths, None)
+                if next_path is not None:
+                    pending.append(executor.submit(load_and_split, next_path, self.text_splitter))
+                yield from chunks
+                del chunks
+
+    def load(self):
+        return list(self.lazy_load())
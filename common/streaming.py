@@ -0,0 +1,127 @@
+import time
+import queue
+import threading
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.callbacks.openai_info import get_openai_token_cost_for_model
+
+from common.tokens import default_token_counter
+
+_DONE = object()
+
+
+class StreamUsage:
+    # Same attributes as the get_openai_callback handler, so UsageUpdater.update_usage accepts it
+    def __init__(self, prompt_tokens=0, completion_tokens=0, total_cost=0.0):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+        self.total_cost = total_cost
+
+
+class TokenStreamHandler(BaseCallbackHandler):
+    # Collects tokens of a streaming LLM on a queue and times the request. With stream_tag set,
+    # only LLM runs carrying that tag are streamed and counted, e.g. the answer LLM of a
+    # ConversationalRetrievalChain but not its (non-streaming) question condenser.
+    # OpenAI sends no token usage for streamed completions, so prompt and completion tokens of
+    # the streamed run are counted locally.
+
+    def __init__(self, stream_tag=None, count_tokens=None):
+        self.stream_tag = stream_tag
+        self.count_tokens = count_tokens or default_token_counter()
+        self.queue = queue.Queue()
+        self.start_time = time.perf_counter()
+        self.first_token_time = None
+        self.end_time = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def _tracked(self, tags):
+        return self.stream_tag is None or self.stream_tag in (tags or [])
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        if self._tracked(kwargs.get("tags")):
+            self.prompt_tokens += sum(self.count_tokens(prompt) for prompt in prompts)
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        if self._tracked(kwargs.get("tags")):
+            # ~4 tokens of chat-format overhead per message, as in OpenAI's token counting guide
+            self.prompt_tokens += sum(self.count_tokens(message.content) + 4 for batch in messages for message in batch)
+
+    def on_llm_new_token(self, token, **kwargs):
+        if not self._tracked(kwargs.get("tags")):
+            return
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.completion_tokens += 1
+        self.queue.put(token)
+
+    def finish(self):
+        self.end_time = time.perf_counter()
+        self.queue.put(_DONE)
+
+    def tokens(self):
+        while True:
+            token = self.queue.get()
+            if token is _DONE:
+                return
+            yield token
+
+    @property
+    def time_to_first_token(self):
+        return None if self.first_token_time is None else self.first_token_time - self.start_time
+
+    @property
+    def total_latency(self):
+        return None if self.end_time is None else self.end_time - self.start_time
+
+    def usage(self, base=None, model_name="gpt-3.5-turbo"):
+        # Streamed tokens plus whatever a get_openai_callback handler (base) saw for the other calls
+        cost = (get_openai_token_cost_for_model(model_name, self.prompt_tokens)
+                + get_openai_token_cost_for_model(model_name, self.completion_tokens, is_completion=True))
+        usage = StreamUsage(self.prompt_tokens, self.completion_tokens, cost)
+        if base is not None:
+            usage.prompt_tokens += base.prompt_tokens
+            usage.completion_tokens += base.completion_tokens
+            usage.total_tokens += base.total_tokens
+            usage.total_cost += base.total_cost
+        return usage
+
+
+class TokenStream:
+    # Runs fn(handler) on a worker thread and iterates over the tokens it streams.
+    # After iteration, result holds fn's return value; an exception in fn is re-raised.
+
+    def __init__(self, fn, handler):
+        self.handler = handler
+        self.result = None
+        self.error = None
+        self.thread = threading.Thread(target=self._run, args=(fn,), daemon=True)
+        self.thread.start()
+
+    def _run(self, fn):
+        try:
+            self.result = fn(self.handler)
+        except Exception as error:
+            self.error = error
+        finally:
+            self.handler.finish()
+
+    def __iter__(self):
+        yield from self.handler.tokens()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def stream_conversation(chain, message, prefix="result: "):
+    # Prints the reply of a ConversationChain built on a streaming LLM token by token, then the
+    # time to first token and total latency, as the command-line ChatBots do. Returns the reply
+    handler = TokenStreamHandler()
+    stream = TokenStream(lambda handler: chain.predict(input=message, callbacks=[handler]), handler)
+    print(prefix, end="", flush=True)
+    for token in stream:
+        print(token, end="", flush=True)
+    first = "n/a" if handler.time_to_first_token is None else f"{handler.time_to_first_token:.2f}s"
+    print(f"\n[time to first token {first}, total {handler.total_latency:.2f}s]")
+    return stream.result
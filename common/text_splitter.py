@@ -0,0 +1,253 @@
+import os
+import re
+import json
+from collections import OrderedDict
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.text_splitter import TextSplitter
+
+from common.hashing import file_hash
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, ".document_cache")
+
+# Boundary levels, strongest first. A chunk ends at the strongest boundary that fits, the furthest one
+# if there are several, so sections and numbered paragraphs of the budget speech stay whole when they fit
+HEADING, PARAGRAPH, BLOCK, LINE, SENTENCE, WORD = range(6)
+
+HEADING_LINE = re.compile(r"^[ \t]*(?:(?:Part|PART)[ \t]+[A-Z]\b[^\n]*|Priority[ \t]+\d+[^\n]*|[A-Z][^\n]{1,78}[^\s.,;:])[ \t]*$", re.M)
+NUMBERED_PARAGRAPH = re.compile(r"^[ \t]*\d{1,3}\.[ \t]+(?=\S)", re.M)
+LIST_ITEM = re.compile(r"^[ \t]*(?:\((?:[ivx]+|[a-z]|\d{1,2})\)|[a-z]\)|[•▪\-–])[ \t]+(?=\S)", re.M)
+BLANK_LINE = re.compile(r"\n[ \t]*\n\s*")
+NEWLINE = re.compile(r"\n[ \t]*")
+SENTENCE_END = re.compile(r"[.?!;][\"'’”)]?[ \t\n]+(?=\S)")
+WHITESPACE = re.compile(r"\s+")
+SENTENCE_CLOSERS = tuple(".:?!)\"'’”")
+
+
+def find_headings(text):
+    # Short capitalised lines without closing punctuation that follow the end of a sentence (or another
+    # heading, or the start of the text) and are followed by a numbered paragraph or another heading,
+    # e.g. "Part B", "Priority 1: Inclusive Development", "Green Growth" before "38. ..."
+    starts, ends = [], []
+    for match in HEADING_LINE.finditer(text):
+        line = match.group().strip()
+        if len(line.split()) > 12 or NUMBERED_PARAGRAPH.match(line):
+            continue
+        before = text[max(0, match.start() - 200):match.start()].rstrip()
+        if before and not before.endswith(SENTENCE_CLOSERS) and not (ends and text[ends[-1]:match.start()].strip() == ""):
+            continue
+        after = text[match.end():match.end() + 200].lstrip()
+        if after and not NUMBERED_PARAGRAPH.match(after) and not HEADING_LINE.match(after):
+            continue
+        starts.append(match.start())
+        ends.append(match.end())
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+
+def find_boundaries(text, page_starts, heading_starts):
+    # Every position a chunk may end (and the next one start) at, with its level. Positions are sorted
+    # and unique; a position found by several patterns keeps its strongest level
+    positions = [heading_starts, page_starts[1:]]
+    levels = [np.full(len(heading_starts), HEADING), np.full(len(page_starts) - 1, BLOCK)]
+    for pattern, level, at_start in ((NUMBERED_PARAGRAPH, PARAGRAPH, True), (LIST_ITEM, BLOCK, True), (BLANK_LINE, BLOCK, False),
+                                     (NEWLINE, LINE, False), (SENTENCE_END, SENTENCE, False), (WHITESPACE, WORD, False)):
+        found = np.fromiter((match.start() if at_start else match.end() for match in pattern.finditer(text)), dtype=np.int64)
+        positions.append(found)
+        levels.append(np.full(len(found), level))
+
+    positions = np.concatenate(positions)
+    levels = np.concatenate(levels)
+    order = np.lexsort((levels, positions))
+    positions, levels = positions[order], levels[order]
+    keep = np.ones(len(positions), dtype=bool)
+    keep[1:] = positions[1:] != positions[:-1]
+    keep &= (positions > 0) & (positions < len(text))
+    dtype = np.int32 if len(text) < 2 ** 31 else np.int64
+    return positions[keep].astype(dtype), levels[keep].astype(np.int8)
+
+
+class StructuredDocument:
+    # The text of a whole document (all pages joined) plus its structure, found once: page start
+    # offsets, heading spans and every possible chunk boundary with its level, as compact numpy arrays.
+    # Chunking at any size is then a walk over these arrays that yields (start, end) offsets into the
+    # text; chunk strings are only sliced out when documents are made. Offsets per chunk setting are
+    # kept, so asking again for the same size costs nothing.
+
+    def __init__(self, text, page_starts, page_metadatas, positions=None, levels=None, heading_starts=None, heading_ends=None):
+        self.text = text
+        self.page_starts = np.asarray(page_starts, dtype=np.int64)
+        self.page_metadatas = page_metadatas
+        if heading_starts is None:
+            heading_starts, heading_ends = find_headings(text)
+        self.heading_starts = np.asarray(heading_starts, dtype=np.int64)
+        self.heading_ends = np.asarray(heading_ends, dtype=np.int64)
+        if positions is None:
+            positions, levels = find_boundaries(text, self.page_starts, self.heading_starts)
+        self.positions = positions
+        self.levels = levels
+        self._offsets = {}
+
+    @classmethod
+    def from_pages(cls, texts, metadatas=None, separator="\n\n"):
+        # Pages are joined with a blank line, so a page break is always a paragraph boundary
+        page_starts = []
+        position = 0
+        for text in texts:
+            page_starts.append(position)
+            position += len(text) + len(separator)
+        return cls(separator.join(texts), page_starts or [0], list(metadatas) if metadatas is not None else [{} for _ in texts])
+
+    def _skip_space(self, position):
+        while position < len(self.text) and self.text[position].isspace():
+            position += 1
+        return position
+
+    def chunk_offsets(self, chunk_size, chunk_overlap=0, min_fill=0.3):
+        # (n, 2) array of [start, end) offsets of chunks of at most chunk_size characters. A chunk ends at
+        # the strongest boundary in the last (1 - min_fill) of its window. Overlap is only added where a
+        # chunk had to end inside a paragraph, and starts at a sentence or line boundary, never mid-word
+        key = (chunk_size, chunk_overlap, min_fill)
+        if key in self._offsets:
+            return self._offsets[key]
+
+        text, positions, levels = self.text, self.positions, self.levels
+        min_length = max(1, int(chunk_size * min_fill))
+        offsets = []
+        start = self._skip_space(0)
+        while start < len(text):
+            limit = start + chunk_size
+            if limit >= len(text):
+                end, level = len(text), HEADING
+            else:
+                lo = np.searchsorted(positions, start + min_length, "left")
+                hi = np.searchsorted(positions, limit, "right")
+                if lo < hi:
+                    # Furthest boundary of the strongest level in the window
+                    index = hi - 1 - int(np.argmin(levels[lo:hi][::-1]))
+                    end, level = int(positions[index]), int(levels[index])
+                else:
+                    end, level = limit, WORD + 1
+
+            chunk_end = end
+            while chunk_end > start and text[chunk_end - 1].isspace():
+                chunk_end -= 1
+            offsets.append((start, chunk_end))
+            if end >= len(text):
+                break
+
+            next_start = end
+            if chunk_overlap and level >= LINE:
+                lo = np.searchsorted(positions, max(start + 1, end - chunk_overlap), "left")
+                hi = np.searchsorted(positions, end, "left")
+                candidates = np.flatnonzero(levels[lo:hi] <= SENTENCE)
+                if len(candidates):
+                    next_start = int(positions[lo + candidates[0]])
+            start = self._skip_space(next_start)
+
+        offsets = np.array(offsets, dtype=self.positions.dtype).reshape(-1, 2)
+        self._offsets[key] = offsets
+        return offsets
+
+    def chunks(self, chunk_size, chunk_overlap=0, min_fill=0.3):
+        return [self.text[start:end] for start, end in self.chunk_offsets(chunk_size, chunk_overlap, min_fill)]
+
+    def documents(self, chunk_size, chunk_overlap=0, min_fill=0.3):
+        # Chunks with the metadata of the page they start on, their offsets and the heading they fall under
+        offsets = self.chunk_offsets(chunk_size, chunk_overlap, min_fill)
+        pages = np.searchsorted(self.page_starts, offsets[:, 0], "right") - 1
+        sections = np.searchsorted(self.heading_starts, offsets[:, 0], "right") - 1
+        docs = []
+        for (start, end), page, section in zip(offsets.tolist(), pages.tolist(), sections.tolist()):
+            metadata = dict(self.page_metadatas[page]) if self.page_metadatas else {}
+            metadata["start_index"] = start
+            metadata["end_index"] = end
+            if section >= 0:
+                metadata["section"] = self.text[self.heading_starts[section]:self.heading_ends[section]].strip()
+            docs.append(Document(page_content=self.text[start:end], metadata=metadata))
+        return docs
+
+    def save(self, path):
+        # Written to a temporary file and renamed, as several worker processes may cache the same pdf
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(file, text=np.frombuffer(self.text.encode("utf-8"), dtype=np.uint8), page_starts=self.page_starts,
+                     metadatas=np.array(json.dumps(self.page_metadatas, default=str)), positions=self.positions, levels=self.levels,
+                     heading_starts=self.heading_starts, heading_ends=self.heading_ends)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["text"].tobytes().decode("utf-8"), data["page_starts"], json.loads(str(data["metadatas"])),
+                       positions=data["positions"], levels=data["levels"], heading_starts=data["heading_starts"], heading_ends=data["heading_ends"])
+
+
+class DocumentCache:
+    # Parsed pdfs as StructuredDocuments, on disk in .document_cache/<hash of the file bytes>.npz and the
+    # last few in memory. Re-chunking a pdf at another size, in any pipeline, neither parses it again
+    # nor finds its structure again.
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_in_memory=16):
+        self.cache_dir = cache_dir
+        self.max_in_memory = max_in_memory
+        self.documents = OrderedDict()
+
+    def load_pdf(self, file_path):
+        key = file_hash(file_path)
+        document = self.documents.get(key)
+        if document is None:
+            path = os.path.join(self.cache_dir, f"{key}.npz")
+            if os.path.exists(path):
+                document = StructuredDocument.load(path)
+            else:
+                from langchain.document_loaders import PyPDFLoader
+
+                pages = PyPDFLoader(file_path).load()
+                document = StructuredDocument.from_pages([page.page_content for page in pages], [page.metadata for page in pages])
+                os.makedirs(self.cache_dir, exist_ok=True)
+                document.save(path)
+            self.documents[key] = document
+            if len(self.documents) > self.max_in_memory:
+                self.documents.popitem(last=False)
+        self.documents.move_to_end(key)
+        # Identical bytes may sit under another path than the one first cached
+        for metadata in document.page_metadatas:
+            metadata["source"] = file_path
+        return document
+
+
+class StructuredTextSplitter(TextSplitter):
+    # Drop-in for RecursiveCharacterTextSplitter built on StructuredDocument: chunks end at headings,
+    # numbered paragraphs and paragraph breaks before lines, sentences or words, carry start/end offsets
+    # and their section heading, and pages of one source are chunked as one text. split_file chunks a
+    # pdf through the DocumentCache. Sizes are in characters (length_function is not used).
+
+    def __init__(self, chunk_size=1000, chunk_overlap=0, min_fill=0.3, cache_dir=DEFAULT_CACHE_DIR, **kwargs):
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, **kwargs)
+        self.min_fill = min_fill
+        self.cache = DocumentCache(cache_dir)
+
+    @property
+    def params(self):
+        # Settings that change the chunks, e.g. for index manifests and cache keys
+        return {"splitter": "structured", "chunk_size": self._chunk_size, "chunk_overlap": self._chunk_overlap, "min_fill": self.min_fill}
+
+    def split_text(self, text):
+        return StructuredDocument.from_pages([text]).chunks(self._chunk_size, self._chunk_overlap, self.min_fill)
+
+    def split_documents(self, documents):
+        # Consecutive pages with the same source are chunked together, so chunks can cross page breaks
+        docs = []
+        group = []
+        for document in list(documents) + [None]:
+            if group and (document is None or document.metadata.get("source") != group[0].metadata.get("source")):
+                structured = StructuredDocument.from_pages([page.page_content for page in group], [page.metadata for page in group])
+                docs.extend(structured.documents(self._chunk_size, self._chunk_overlap, self.min_fill))
+                group = []
+            if document is not None:
+                group.append(document)
+        return docs
+
+    def split_file(self, file_path):
+        return self.cache.load_pdf(file_path).documents(self._chunk_size, self._chunk_overlap, self.min_fill)
@@ -0,0 +1,15 @@
+_token_counter = None
+
+
+def default_token_counter():
+    # One tokenizer per process. cl100k_base is the GPT-3.5 tokenizer; tiktoken only works offline once
+    # its encoding file is cached, otherwise ~4 characters count as a token, close enough for budgets
+    global _token_counter
+    if _token_counter is None:
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding("cl100k_base")
+            _token_counter = lambda text: len(encoding.encode(text))
+        except Exception:
+            _token_counter = lambda text: (len(text) + 3) // 4
+    return _token_counter
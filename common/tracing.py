@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import uuid
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+# Stages a request is broken into. Chains tagged with one of these names (e.g. the question
+# generator of a ConversationalRetrievalChain tagged "condense") put their LLM calls in that stage
+STAGES = ("load", "split", "load_split", "embed", "retrieve", "cache_lookup", "pack", "condense", "generate", "upsert")
+TOKEN_KEYS = ("prompt_tokens", "completion_tokens")
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    # One traced request: wall time of every stage it went through, with token counts and sizes.
+    # Stages may nest (embed inside retrieve), so their seconds do not have to add up to the total.
+
+    def __init__(self, name, attrs=None):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = dict(attrs or {})
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.stages = []
+        self.lock = threading.Lock()
+        self._handler = None
+
+    @property
+    def callbacks(self):
+        # Pass as callbacks=trace.callbacks to a chain or retriever call to trace its LLM and retriever runs
+        if self._handler is None:
+            self._handler = StageCallbackHandler(self)
+        return [self._handler]
+
+    def add(self, stage, seconds, start=None, **attrs):
+        record = {"stage": stage, "offset": round((start if start is not None else time.perf_counter() - seconds) - self.start, 6), "seconds": round(seconds, 6)}
+        record.update(attrs)
+        with self.lock:
+            self.stages.append(record)
+
+    def finish(self):
+        seconds = time.perf_counter() - self.start
+        with self.lock:
+            stages = sorted(self.stages, key=lambda record: record["offset"])
+        return {"trace_id": self.trace_id, "name": self.name, "time": self.started, "seconds": round(seconds, 6), **self.attrs, "stages": stages}
+
+
+class _NoTrace:
+    # Stand-in for requests that are not sampled: no handler, nothing recorded
+    callbacks = []
+
+    @property
+    def attrs(self):
+        return {}
+
+    def add(self, stage, seconds, start=None, **attrs):
+        pass
+
+
+NO_TRACE = _NoTrace()
+
+
+@contextmanager
+def stage(name, **attrs):
+    # Times a block as a stage of the trace active in this context; a no-op outside a sampled trace.
+    # The yielded dict can be filled with sizes found inside the block, e.g. record["docs"] = len(docs)
+    trace = _current_trace.get()
+    if trace is None:
+        yield attrs
+        return
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        trace.add(name, time.perf_counter() - start, start=start, **attrs)
+
+
+@contextmanager
+def activate(trace):
+    # Makes a trace from Tracer.start current in this block, so its stage() blocks are recorded.
+    # A generator sets it around each stretch between yields, as it may resume in another context
+    if trace is NO_TRACE:
+        yield trace
+        return
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+class StageCallbackHandler(BaseCallbackHandler):
+    # Turns langchain callback events into stages of a Trace. Retriever runs become "retrieve";
+    # an LLM run belongs to the nearest enclosing chain tagged with a stage name, else "generate".
+    # Token counts come from the provider's usage report, or are counted from streamed tokens.
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.run_stage = {}
+        self.runs = {}
+        self.lock = threading.Lock()
+
+    def _stage_for(self, tags, parent_run_id):
+        for tag in tags or []:
+            if tag in STAGES:
+                return tag
+        with self.lock:
+            return self.run_stage.get(parent_run_id)
+
+    def _start(self, run_id, stage, **attrs):
+        with self.lock:
+            self.run_stage[run_id] = stage
+            self.runs[run_id] = [stage, time.perf_counter(), attrs]
+
+    def _end(self, run_id, **attrs):
+        with self.lock:
+            self.run_stage.pop(run_id, None)
+            run = self.runs.pop(run_id, None)
+        if run is None:
+            return
+        stage, start, start_attrs = run
+        start_attrs.update(attrs)
+        self.trace.add(stage, time.perf_counter() - start, start=start, **start_attrs)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        # Chains are not stages themselves, they only pass their stage on to the runs inside them
+        stage = self._stage_for(tags, parent_run_id)
+        if stage is not None:
+            with self.lock:
+                self.run_stage[run_id] = stage
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        with self.lock:
+            self.run_stage.pop(run_id, None)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.on_chain_end(None, run_id=run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        self._start(run_id, self._stage_for(tags, parent_run_id) or "generate", prompt_chars=sum(len(prompt) for prompt in prompts))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        self._start(run_id, self._stage_for(tags, parent_run_id) or "generate",
+                    prompt_chars=sum(len(message.content) for batch in messages for message in batch))
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        # Streamed completions carry no usage report, so their tokens are counted as they arrive
+        with self.lock:
+            run = self.runs.get(run_id)
+            if run is not None:
+                run[2]["completion_tokens"] = run[2].get("completion_tokens", 0) + 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        attrs = {key: usage[key] for key in TOKEN_KEYS if key in usage}
+        attrs["completion_chars"] = sum(len(generation.text) for generations in response.generations for generation in generations)
+        self._end(run_id, **attrs)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=type(error).__name__)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        self._start(run_id, "retrieve", query_chars=len(query))
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, docs=len(documents), doc_chars=sum(len(doc.page_content) for doc in documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=type(error).__name__)
+
+
+class Tracer:
+    # Per-request stage tracing. sample_rate is the fraction of requests traced; the rest only cost a
+    # random() call, since they get no callback handler and stage() does nothing for them.
+    # Finished traces go to every exporter (JSONLExporter, PrometheusExporter or anything with export(record)).
+
+    def __init__(self, sample_rate=1.0, exporters=()):
+        self.sample_rate = sample_rate
+        self.exporters = list(exporters)
+
+    @classmethod
+    def from_env(cls, exporters=(), default_rate=1.0):
+        # TRACE_SAMPLE_RATE=0.05 traces one request in twenty, 0 turns tracing off
+        return cls(float(os.getenv("TRACE_SAMPLE_RATE", default_rate)), exporters)
+
+    def start(self, name, **attrs):
+        # Returns a Trace, or NO_TRACE when the request is not sampled. Pair with finish(trace);
+        # unlike trace(), stage() blocks are only attached to it inside activate(trace)
+        if self.sample_rate <= 0 or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return NO_TRACE
+        return Trace(name, attrs)
+
+    def finish(self, trace):
+        if trace is NO_TRACE:
+            return None
+        record = trace.finish()
+        for exporter in self.exporters:
+            try:
+                exporter.export(record)
+            except Exception as error:
+                # Tracing never fails the request it traces
+                print(f"trace export failed: {error!r}")
+        return record
+
+    @contextmanager
+    def trace(self, name, **attrs):
+        # Traces the block as one request; stage() blocks run in it (same thread or task) are recorded too
+        trace = self.start(name, **attrs)
+        if trace is NO_TRACE:
+            yield trace
+            return
+        try:
+            with activate(trace):
+                yield trace
+        except BaseException as error:
+            trace.attrs["error"] = type(error).__name__
+            raise
+        finally:
+            self.finish(trace)
+
+
+class JSONLExporter:
+    # Appends one json line per finished trace
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def export(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line)
+
+
+class PrometheusExporter:
+    # Aggregates finished traces into histograms of request and stage seconds plus counters of stage
+    # tokens and sizes, labelled by request name and stage. render() gives the Prometheus text format;
+    # write() saves it for the node_exporter textfile collector. With sampling, counts cover the
+    # sampled requests only, while the latency distributions still stand for all requests.
+
+    def __init__(self, prefix="rag", buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.histograms = defaultdict(lambda: {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0})
+        self.counters = defaultdict(float)
+
+    def _observe(self, name, labels, value):
+        histogram = self.histograms[(name, labels)]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+        histogram["count"] += 1
+        histogram["sum"] += value
+
+    def export(self, record):
+        request = record["name"]
+        with self.lock:
+            self._observe("request_seconds", (("pipeline", request),), record["seconds"])
+            for entry in record["stages"]:
+                labels = (("pipeline", request), ("stage", entry["stage"]))
+                self._observe("stage_seconds", labels, entry["seconds"])
+                for key, value in entry.items():
+                    if key in ("stage", "offset", "seconds") or isinstance(value, bool) or not isinstance(value, (int, float)):
+                        continue
+                    metric = "stage_tokens_total" if key in TOKEN_KEYS else "stage_size_total"
+                    self.counters[(metric, labels + (("kind", key),))] += value
+                if "error" in entry:
+                    self.counters[("stage_errors_total", labels)] += 1
+
+    def render(self):
+        def format_labels(labels, extra=()):
+            return "{" + ",".join(f'{key}="{str(value)}"' for key, value in labels + extra) + "}"
+
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {self.prefix}_{name} histogram")
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(self.buckets, histogram["buckets"]):
+                        lines.append(f"{self.prefix}_{name}_bucket{format_labels(labels, (('le', bound),))} {count}")
+                    lines.append(f"{self.prefix}_{name}_bucket{format_labels(labels, (('le', '+Inf'),))} {histogram['count']}")
+                    lines.append(f"{self.prefix}_{name}_sum{format_labels(labels)} {histogram['sum']:.6f}")
+                    lines.append(f"{self.prefix}_{name}_count{format_labels(labels)} {histogram['count']}")
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {self.prefix}_{name} counter")
+                for (metric, labels), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f"{self.prefix}_{name}{format_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # Written to a temporary file and renamed, so a scraper never reads a half-written file
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(self.render())
+        os.replace(tmp_path, path)
@@ -0,0 +1,92 @@
+import os
+import sys
+
+from langchain.docstore.document import Document
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.tokens import default_token_counter
+
+
+def overlap_length(first, second, min_overlap):
+    # Length of the longest suffix of `first` that is a prefix of `second`
+    probe = second[:min_overlap]
+    if len(probe) < min_overlap:
+        return 0
+    start = first.find(probe, max(0, len(first) - len(second)))
+    while start != -1:
+        if second.startswith(first[start:]):
+            return len(first) - start
+        start = first.find(probe, start + 1)
+    return 0
+
+
+class ContextPacker:
+    # Turns the ranked chunks from DocumentSearch into the context of the "stuff" chain:
+    # exact and contained duplicates are dropped, chunks of the same page that overlap
+    # (the splitter repeats chunk_overlap characters) are stitched together, and the result
+    # is added in relevance order until the token budget is full.
+
+    def __init__(self, token_budget=1500, min_overlap=20, count_tokens=None):
+        self.token_budget = token_budget
+        self.min_overlap = min_overlap
+        self.count_tokens = count_tokens or default_token_counter()
+
+    def join(self, first, second):
+        # Text covering both chunks if one contains or overlaps the other, else None
+        if second in first:
+            return first
+        if first in second:
+            return second
+        length = overlap_length(first, second, self.min_overlap)
+        if length:
+            return first + second[length:]
+        length = overlap_length(second, first, self.min_overlap)
+        if length:
+            return second + first[length:]
+        return None
+
+    def merge(self, docs):
+        # Entries are [rank, (source, page), text, metadata]; rank is the best rank of the parts.
+        # Merging repeats until stable, so a chunk that bridges two others joins all three.
+        entries = [[rank, (doc.metadata.get("source"), doc.metadata.get("page")), doc.page_content, doc.metadata] for rank, doc in enumerate(docs)]
+        while True:
+            merged = []
+            for entry in entries:
+                for target in merged:
+                    if target[1] != entry[1]:
+                        continue
+                    text = self.join(target[2], entry[2])
+                    if text is not None:
+                        target[0] = min(target[0], entry[0])
+                        target[2] = text
+                        break
+                else:
+                    merged.append(entry)
+            if len(merged) == len(entries):
+                return merged
+            entries = merged
+
+    def pack(self, docs):
+        # Returns (documents for the chain, report with token counts before and after packing)
+        tokens_in = sum(self.count_tokens(doc.page_content) for doc in docs)
+
+        packed = []
+        used = 0
+        dropped = 0
+        for rank, _, text, metadata in sorted(self.merge(docs), key=lambda entry: entry[0]):
+            tokens = self.count_tokens(text)
+            if used + tokens > self.token_budget:
+                dropped += 1
+                continue
+            packed.append(Document(page_content=text, metadata=metadata))
+            used += tokens
+
+        report = {
+            "chunks_in": len(docs),
+            "chunks_out": len(packed),
+            "chunks_dropped_for_budget": dropped,
+            "tokens_in": tokens_in,
+            "tokens_out": used,
+            "tokens_saved": tokens_in - used,
+        }
+        return packed, report
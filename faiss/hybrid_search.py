@@ -0,0 +1,156 @@
+import re
+import json
+import math
+import time
+import heapq
+from collections import Counter, defaultdict
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    # In-process inverted index over the chunk texts of the FAISS store, keyed by docstore id
+
+    def __init__(self, ids, doc_lengths, postings, k1=1.5, b=0.75):
+        self.ids = ids
+        self.doc_lengths = doc_lengths
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        self.avg_length = (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0
+        self.idf = {term: math.log(1 + (len(ids) - len(docs) + 0.5) / (len(docs) + 0.5)) for term, docs in postings.items()}
+
+    @classmethod
+    def build(cls, ids, texts, k1=1.5, b=0.75):
+        postings = defaultdict(list)
+        doc_lengths = []
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                postings[term].append((position, count))
+        return cls(list(ids), doc_lengths, dict(postings), k1, b)
+
+    @classmethod
+    def from_faiss(cls, db):
+        # Indexes the chunks of a langchain FAISS store in index order
+        ids = [db.index_to_docstore_id[position] for position in sorted(db.index_to_docstore_id)]
+        return cls.build(ids, [db.docstore.search(doc_id).page_content for doc_id in ids])
+
+    def search(self, query, k=20):
+        # Returns [(docstore id, score)] of the k best BM25 matches
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position, count in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[position] / self.avg_length)
+                scores[position] += idf * count * (self.k1 + 1) / (count + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.ids[position], score) for position, score in best]
+
+    def save(self, path):
+        with open(path, "w") as file:
+            json.dump({"k1": self.k1, "b": self.b, "ids": self.ids, "doc_lengths": self.doc_lengths, "postings": self.postings}, file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as file:
+            data = json.load(file)
+        postings = {term: [tuple(entry) for entry in docs] for term, docs in data["postings"].items()}
+        return cls(data["ids"], data["doc_lengths"], postings, data["k1"], data["b"])
+
+
+def dense_search_ids(db, query, k):
+    # [(docstore id, distance)] from either a langchain FAISS store or an MmapVectorStore
+    if hasattr(db, "similarity_search_ids"):
+        return db.similarity_search_ids(query, k)
+    vector = np.asarray([db.embedding_function(query)], dtype=np.float32)
+    distances, positions = db.index.search(vector, k)
+    return [(db.index_to_docstore_id[int(position)], float(distance)) for position, distance in zip(positions[0], distances[0]) if position != -1]
+
+
+def get_documents(db, doc_ids):
+    if hasattr(db, "get_documents"):
+        return db.get_documents(doc_ids)
+    return {doc_id: db.docstore.search(doc_id) for doc_id in doc_ids}
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=60):
+    # Each ranking is a list of ids, best first; ids found high in several rankings win
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (rrf_k + rank + 1)
+    return [doc_id for doc_id, _ in sorted(scores.items(), key=lambda item: -item[1])]
+
+
+class HybridRetriever:
+    # Dense FAISS top-n and BM25 top-n fused with reciprocal rank fusion, optionally reranked on CPU
+    # with a cross-encoder. stage_budgets holds seconds per stage: the rerank stage scores the fused
+    # candidates in small batches and stops when its budget is spent, and is skipped entirely once
+    # the "total" budget is used up by retrieval.
+
+    def __init__(self, embedding_db, bm25_index, reranker_model=None, candidates=20, rrf_k=60, stage_budgets=None, rerank_batch_size=8):
+        self.embedding_db = embedding_db
+        self.bm25_index = bm25_index
+        self.reranker_model = reranker_model
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.stage_budgets = stage_budgets or {}
+        self.rerank_batch_size = rerank_batch_size
+        self._reranker = None
+        self.last_timings = {}
+
+    @property
+    def reranker(self):
+        if self._reranker is None and self.reranker_model:
+            from sentence_transformers import CrossEncoder
+            self._reranker = CrossEncoder(self.reranker_model)
+        return self._reranker
+
+    def rerank(self, query, doc_ids, docs, deadline):
+        scored = []
+        position = 0
+        while position < len(doc_ids) and time.perf_counter() < deadline:
+            batch = doc_ids[position:position + self.rerank_batch_size]
+            scores = self.reranker.predict([(query, docs[doc_id].page_content) for doc_id in batch])
+            scored.extend(zip(batch, scores))
+            position += len(batch)
+        # Candidates the budget did not reach keep their fused order behind the reranked ones
+        reranked = [doc_id for doc_id, _ in sorted(scored, key=lambda item: -item[1])]
+        return reranked + doc_ids[position:]
+
+    def search(self, query, k=5):
+        timings = {}
+        start = time.perf_counter()
+
+        dense_ids = [doc_id for doc_id, _ in dense_search_ids(self.embedding_db, query, self.candidates)]
+        timings["dense"] = time.perf_counter() - start
+
+        stage_start = time.perf_counter()
+        keyword_ids = [doc_id for doc_id, _ in self.bm25_index.search(query, self.candidates)]
+        timings["bm25"] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        fused = reciprocal_rank_fusion([dense_ids, keyword_ids], self.rrf_k)[:self.candidates]
+        docs = get_documents(self.embedding_db, fused)
+        timings["fuse"] = time.perf_counter() - stage_start
+
+        total_budget = self.stage_budgets.get("total", float("inf"))
+        if self.reranker_model and time.perf_counter() - start < total_budget:
+            stage_start = time.perf_counter()
+            deadline = stage_start + min(self.stage_budgets.get("rerank", float("inf")), total_budget - (stage_start - start))
+            fused = self.rerank(query, fused, docs, deadline)
+            timings["rerank"] = time.perf_counter() - stage_start
+
+        timings["total"] = time.perf_counter() - start
+        self.last_timings = timings
+        return [docs[doc_id] for doc_id in fused[:k]]
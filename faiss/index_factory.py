@@ -0,0 +1,170 @@
+import math
+import time
+
+import numpy as np
+import faiss
+from langchain.docstore.document import Document
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.vectorstores import FAISS
+
+INDEX_KINDS = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq8")
+
+
+class IndexConfig:
+    # Describes which FAISS index to build and how to search it
+
+    def __init__(self, kind="flat", nlist=None, pq_m=16, pq_nbits=8, hnsw_m=32, train_sample=20000, nprobe=None, ef_search=None, seed=0):
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"Unknown index kind '{kind}', expected one of {INDEX_KINDS}")
+        self.kind = kind
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.hnsw_m = hnsw_m
+        self.train_sample = train_sample
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.seed = seed
+
+    def factory_string(self, dim, n_vectors):
+        # IVF needs ~39 training points per centroid, so nlist is capped by the corpus size
+        nlist = self.nlist or int(4 * math.sqrt(max(n_vectors, 1)))
+        nlist = max(1, min(nlist, n_vectors // 39 or 1))
+
+        if self.kind == "flat":
+            return "Flat"
+        if self.kind == "ivf_flat":
+            return f"IVF{nlist},Flat"
+        if self.kind == "ivf_pq":
+            if dim % self.pq_m:
+                raise ValueError(f"pq_m={self.pq_m} must divide the embedding dimension {dim}")
+            # Small corpora cannot train 256 centroids per sub-quantizer
+            nbits = min(self.pq_nbits, max(4, int(math.log2(max(n_vectors // 39, 16)))))
+            return f"IVF{nlist},PQ{self.pq_m}x{nbits}"
+        if self.kind == "hnsw":
+            return f"HNSW{self.hnsw_m}"
+        return "SQ8"
+
+    def build_params(self):
+        # Parameters that change the stored index; search-time knobs are left out
+        return {"kind": self.kind, "nlist": self.nlist, "pq_m": self.pq_m, "pq_nbits": self.pq_nbits, "hnsw_m": self.hnsw_m}
+
+
+def is_ivf(index):
+    try:
+        faiss.extract_index_ivf(index)
+        return True
+    except RuntimeError:
+        return False
+
+
+def is_hnsw(index):
+    return hasattr(faiss.downcast_index(index), "hnsw")
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    # nprobe only applies to IVF indexes and efSearch only to HNSW, others ignore them
+    params = faiss.ParameterSpace()
+    if nprobe is not None and is_ivf(index):
+        params.set_index_parameter(index, "nprobe", nprobe)
+    if ef_search is not None and is_hnsw(index):
+        params.set_index_parameter(index, "efSearch", ef_search)
+
+
+def build_index(vectors, config):
+    # Build (and, where needed, train on a random sample of) a FAISS index for the vectors
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n_vectors, dim = vectors.shape
+    index = faiss.index_factory(dim, config.factory_string(dim, n_vectors), faiss.METRIC_L2)
+
+    if not index.is_trained:
+        rng = np.random.default_rng(config.seed)
+        sample_size = min(n_vectors, config.train_sample)
+        sample = vectors[rng.choice(n_vectors, sample_size, replace=False)]
+        index.train(sample)
+
+    index.add(vectors)
+    set_search_params(index, config.nprobe, config.ef_search)
+    return index
+
+
+def build_faiss_store(text_embeddings, embeddings, metadatas, ids, config):
+    # Same result as FAISS.from_embeddings, but with a configurable index type
+    texts = [text for text, _ in text_embeddings]
+    index = build_index([vector for _, vector in text_embeddings], config)
+
+    docstore = InMemoryDocstore({doc_id: Document(page_content=text, metadata=metadata) for doc_id, text, metadata in zip(ids, texts, metadatas)})
+    index_to_docstore_id = dict(enumerate(ids))
+    return FAISS(embeddings.embed_query, index, docstore, index_to_docstore_id)
+
+
+def evaluate_index_configs(vectors, query_vectors, configs, k=5, search_params=None):
+    # Recall@k and per-query latency of each config against an exact flat baseline.
+    # search_params maps a config kind to a list of {"nprobe": ..} / {"ef_search": ..} to sweep.
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+    search_params = search_params or {}
+
+    flat = build_index(vectors, IndexConfig("flat"))
+    _, truth = flat.search(query_vectors, k)
+
+    report = []
+    for config in [IndexConfig("flat")] + list(configs):
+        start = time.perf_counter()
+        index = flat if config.kind == "flat" else build_index(vectors, config)
+        build_seconds = time.perf_counter() - start
+        index_bytes = faiss.serialize_index(index).nbytes
+
+        for params in search_params.get(config.kind, [{}]):
+            set_search_params(index, params.get("nprobe"), params.get("ef_search"))
+
+            latencies = []
+            hits = 0
+            for query, expected in zip(query_vectors, truth):
+                start = time.perf_counter()
+                _, found = index.search(query.reshape(1, -1), k)
+                latencies.append(time.perf_counter() - start)
+                hits += len(set(found[0]) & set(expected))
+
+            latencies.sort()
+            report.append({
+                "kind": config.kind,
+                "factory": config.factory_string(vectors.shape[1], vectors.shape[0]),
+                "params": params,
+                "recall_at_k": hits / (k * len(query_vectors)),
+                "mean_latency_ms": 1000 * sum(latencies) / len(latencies),
+                "p99_latency_ms": 1000 * latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))],
+                "build_seconds": build_seconds,
+                "index_bytes": index_bytes,
+            })
+    return report
+
+
+def print_report(report):
+    print(f"{'factory':<22}{'params':<20}{'recall@k':>10}{'mean ms':>10}{'p99 ms':>10}{'build s':>10}{'MB':>8}")
+    for row in report:
+        params = ",".join(f"{key}={value}" for key, value in row["params"].items()) or "-"
+        print(f"{row['factory']:<22}{params:<20}{row['recall_at_k']:>10.3f}{row['mean_latency_ms']:>10.3f}"
+              f"{row['p99_latency_ms']:>10.3f}{row['build_seconds']:>10.2f}{row['index_bytes'] / 2 ** 20:>8.2f}")
+
+
+if __name__ == "__main__":
+    # Recall-vs-latency report for the vectors in the saved index, using a sample of them as queries
+    stored = faiss.read_index("faiss_index/index.faiss")
+    if not isinstance(faiss.downcast_index(stored), faiss.IndexFlat):
+        raise SystemExit("The report needs exact vectors, rebuild faiss_index with the default flat index first")
+    vectors = stored.reconstruct_n(0, stored.ntotal)
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), min(200, len(vectors)), replace=False)]
+
+    report = evaluate_index_configs(
+        vectors,
+        queries,
+        [IndexConfig("ivf_flat"), IndexConfig("ivf_pq"), IndexConfig("hnsw"), IndexConfig("sq8")],
+        k=5,
+        search_params={
+            "ivf_flat": [{"nprobe": 1}, {"nprobe": 4}, {"nprobe": 16}],
+            "ivf_pq": [{"nprobe": 1}, {"nprobe": 4}, {"nprobe": 16}],
+            "hnsw": [{"ef_search": 16}, {"ef_search": 64}, {"ef_search": 128}],
+        })
+    print_report(report)
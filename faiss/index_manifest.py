@@ -0,0 +1,73 @@
+import os
+import sys
+import json
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.hashing import file_hash
+
+MANIFEST_FILE = "manifest.json"
+
+
+class IndexManifest:
+    # Per-file and per-chunk content hashes stored next to index.faiss/index.pkl
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.manifest_path = os.path.join(index_path, MANIFEST_FILE)
+        self.files = {}
+        self.index_params = {}
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as file:
+                data = json.load(file)
+            self.files = data.get("files", {})
+            self.index_params = data.get("index", {})
+        else:
+            self.files = {}
+            self.index_params = {}
+
+    def save(self):
+        if not os.path.exists(self.index_path):
+            os.makedirs(self.index_path)
+
+        # Write to a temp file first so a crash never leaves a half-written manifest
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"index": self.index_params, "files": self.files}, file, indent=4)
+        os.replace(tmp_path, self.manifest_path)
+
+    def is_empty(self):
+        return not self.files
+
+    def diff(self, file_paths):
+        # Split the current directory listing into changed, unchanged and removed files
+        current = {os.path.basename(path): path for path in file_paths}
+        hashes = {}
+        changed = []
+        unchanged = []
+
+        for name, path in current.items():
+            hashes[name] = file_hash(path)
+            entry = self.files.get(name)
+            if entry is not None and entry["sha256"] == hashes[name]:
+                unchanged.append(path)
+            else:
+                changed.append(path)
+
+        removed = [name for name in self.files if name not in current]
+        return changed, unchanged, removed, hashes
+
+    def chunk_ids(self, names=None):
+        names = self.files.keys() if names is None else names
+        ids = set()
+        for name in names:
+            ids.update(self.files.get(name, {}).get("chunks", []))
+        return ids
+
+    def update_file(self, name, sha256, ids):
+        self.files[name] = {"sha256": sha256, "chunks": list(ids)}
+
+    def remove_file(self, name):
+        self.files.pop(name, None)
@@ -1,41 +1,101 @@
 import os
+import sys
+import glob
 import json
+import shutil
 from dotenv import load_dotenv
 import openai
-from langchain.chat_models import ChatOpenAI
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.document_loaders import PyPDFLoader
-from langchain.embeddings import SentenceTransformerEmbeddings
 from langchain.vectorstores import FAISS
 from langchain.chains.question_answering import load_qa_chain
 from langchain.document_loaders import DirectoryLoader
 from helicone.openai_proxy import openai
+from index_manifest import IndexManifest
+from index_factory import IndexConfig, build_faiss_store, set_search_params
+from mmap_store import MmapVectorStore
+from hybrid_search import BM25Index, HybridRetriever
+from context_packer import ContextPacker
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.clients import configure_openai, get_chat_model
+from common.pdf_loader import ParallelPDFLoader
+from common.embeddings import CachedEmbeddings
+from common.answer_cache import AnswerCache
+from common.hashing import assign_chunk_ids
+from common.tracing import Tracer, JSONLExporter, PrometheusExporter, stage
+from common.text_splitter import StructuredTextSplitter
 
 class OpenAIConfig:
     def __init__(self, api_key, api_base):
         # Configure OpenAI API settings
-        openai.api_type = "azure"
-        openai.api_version = "2023-05-15"
-        openai.api_key = api_key
-        openai.api_base = api_base
+        configure_openai(api_key, api_base)
 
 class DocumentProcessor:
-    def __init__(self, dir_path):
+    def __init__(self, dir_path, max_workers=None):
         # Load PDF documents and initialize text splitter
-        
+        self.dir_path = dir_path
+        self.max_workers = max_workers
         self.loader = DirectoryLoader(dir_path, glob="./*.pdf", loader_cls=PyPDFLoader)
-        self.documents = self.loader.load()
+        self._documents = None
         
-        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
+        # Chunks end at headings and numbered paragraphs first; the parsed PDFs are cached in .document_cache/
+        self.text_splitter = StructuredTextSplitter(chunk_size=500, chunk_overlap=100)
+
+    @property
+    def documents(self):
+        # PDFs are parsed on first access so incremental builds can skip unchanged files
+        if self._documents is None:
+            with stage("load") as record:
+                self._documents = self.loader.load()
+                record["pages"] = len(self._documents)
+        return self._documents
+
+    def list_files(self):
+        # PDF files the directory loader would pick up
+        return sorted(glob.glob(os.path.join(self.dir_path, "*.pdf")))
     
     def split_documents(self):
         # Split loaded documents into chunks using text splitter
-        return self.text_splitter.split_documents(self.documents)
+        documents = self.documents
+        with stage("split") as record:
+            chunks = self.text_splitter.split_documents(documents)
+            record["chunks"] = len(chunks)
+        return chunks
+
+    def iter_chunks(self, file_paths=None):
+        # Stream chunks while PDFs are parsed in a process pool
+        file_paths = self.list_files() if file_paths is None else file_paths
+        return ParallelPDFLoader(file_paths, self.text_splitter, max_workers=self.max_workers).lazy_load()
+
+    def split_files(self, file_paths, batch_size=256):
+        # Load and split only the given PDF files; both happen per file in the worker processes.
+        # Yields lists of up to batch_size chunks as they arrive, so embedding overlaps parsing
+        # (the stage therefore spans the whole stream, embedding of earlier batches included)
+        with stage("load_split", files=len(file_paths)) as record:
+            record["chunks"] = 0
+            batch = []
+            for chunk in self.iter_chunks(file_paths):
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    record["chunks"] += len(batch)
+                    yield batch
+                    batch = []
+            if batch:
+                record["chunks"] += len(batch)
+                yield batch
 
 class EmbeddingProcessor:
-    def __init__(self, model_name):
-        # Initialize instructor embeddings using HuggingFace model
-        self.embeddings = SentenceTransformerEmbeddings(model_name=model_name)
+    def __init__(self, model_name, batch_size=64, num_workers=1, index_config=None):
+        # Initialize sentence-transformer embeddings backed by the shared on-disk embedding cache
+        self.embeddings = CachedEmbeddings(model_name=model_name, batch_size=batch_size, num_workers=num_workers)
+        # Flat (exact) index unless an IVF / PQ / HNSW / SQ config is given
+        self.index_config = index_config or IndexConfig()
+
+    def build_database(self, text_embeddings, metadatas, ids):
+        # Build a FAISS store with the configured index type
+        if self.index_config.kind == "flat":
+            return FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas, ids=ids)
+        return build_faiss_store(text_embeddings, self.embeddings, metadatas, ids, self.index_config)
     
     def create_embedding_database(self, docs):
         # Create embedding database using FAISS for the given documents and embeddings
@@ -43,19 +103,149 @@ class EmbeddingProcessor:
         try:
             db = FAISS.load_local("faiss_index", self.embeddings)
         except:
-            db = FAISS.from_documents(docs, self.embeddings)
+            texts = [doc.page_content for doc in docs]
+            vectors = self.embeddings.embed_documents(texts)
+            db = self.build_database(list(zip(texts, vectors)), [doc.metadata for doc in docs], assign_chunk_ids(docs))
             db.save_local("faiss_index")
             
         return db
 
+    def update_embedding_database(self, document_processor, index_path="faiss_index"):
+        # Incrementally sync the FAISS index with the input directory using the manifest:
+        # unchanged files are skipped, only new chunks are embedded and stale vectors dropped.
+        # Returns None when the directory has no chunks to index
+        manifest = IndexManifest(index_path)
+        # Chunk settings are part of the index: changing them rebuilds it (re-chunking reuses the cached PDF parses)
+        index_params = {**self.index_config.build_params(), **document_processor.text_splitter.params}
+
+        db = None
+        if not manifest.is_empty() and manifest.index_params == index_params:
+            try:
+                db = FAISS.load_local(index_path, self.embeddings)
+            except Exception:
+                db = None
+        if db is None:
+            # An index without a manifest (or vice versa, or built with another index type) is rebuilt
+            manifest.files = {}
+            manifest.index_params = index_params
+
+        changed, unchanged, removed, hashes = manifest.diff(document_processor.list_files())
+        if db is not None and not changed and not removed:
+            if not os.path.exists(os.path.join(index_path, "mmap")):
+                MmapVectorStore.export(db, os.path.join(index_path, "mmap"))
+            if not os.path.exists(os.path.join(index_path, "bm25.json")):
+                BM25Index.from_faiss(db).save(os.path.join(index_path, "bm25.json"))
+            return db
+
+        changed_names = [os.path.basename(path) for path in changed]
+        existing_ids = set(db.index_to_docstore_id.values()) if db is not None else set()
+        file_ids = {name: [] for name in changed_names}
+        text_embeddings, metadatas, ids = [], [], []
+        seen = {}
+
+        # Chunks are embedded batch by batch while later PDFs are still being parsed
+        for batch in document_processor.split_files(changed):
+            batch_ids = assign_chunk_ids(batch, seen)
+            for doc_id, doc in zip(batch_ids, batch):
+                file_ids.setdefault(os.path.basename(doc.metadata.get("source", "")), []).append(doc_id)
+
+            if db is not None:
+                # Refresh metadata (e.g. page numbers) of chunks whose text did not change
+                db.docstore._dict.update({doc_id: doc for doc_id, doc in zip(batch_ids, batch) if doc_id in existing_ids})
+
+            pending = [(doc_id, doc) for doc_id, doc in zip(batch_ids, batch) if doc_id not in existing_ids]
+            if pending:
+                vectors = self.embeddings.embed_documents([doc.page_content for _, doc in pending])
+                text_embeddings.extend((doc.page_content, vector) for (_, doc), vector in zip(pending, vectors))
+                metadatas.extend(doc.metadata for _, doc in pending)
+                ids.extend(doc_id for doc_id, _ in pending)
+
+        new_ids = {doc_id for name_ids in file_ids.values() for doc_id in name_ids}
+        stale_ids = manifest.chunk_ids(changed_names + removed) - new_ids
+
+        kept = set(db.index_to_docstore_id.values()) - stale_ids if db is not None else set()
+        if not ids and not kept:
+            # No chunks left (every PDF deleted, or none yet): FAISS cannot build an empty store, so the
+            # index files go and the manifest is emptied; the next PDF added rebuilds from scratch
+            for name in ("index.faiss", "index.pkl", "bm25.json"):
+                if os.path.exists(os.path.join(index_path, name)):
+                    os.remove(os.path.join(index_path, name))
+            shutil.rmtree(os.path.join(index_path, "mmap"), ignore_errors=True)
+            manifest.files = {}
+            manifest.save()
+            return None
+
+        if db is not None and stale_ids:
+            # FAISS indexes cannot drop rows in place, so rebuild from the kept chunks. Their vectors
+            # come from the embedding cache (exact, unlike reconstructing from a PQ/SQ index).
+            kept_docs = [db.docstore.search(doc_id) for doc_id in db.index_to_docstore_id.values() if doc_id not in stale_ids]
+            kept_ids = [doc_id for doc_id in db.index_to_docstore_id.values() if doc_id not in stale_ids]
+            kept_texts = [doc.page_content for doc in kept_docs]
+            text_embeddings.extend(zip(kept_texts, self.embeddings.embed_documents(kept_texts)))
+            metadatas.extend(doc.metadata for doc in kept_docs)
+            ids.extend(kept_ids)
+            db = self.build_database(text_embeddings, metadatas, ids)
+        elif db is not None:
+            if text_embeddings:
+                db.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        else:
+            db = self.build_database(text_embeddings, metadatas, ids)
+
+        db.save_local(index_path)
+        # Memory-mapped copy for search-only processes, see load_search_store
+        MmapVectorStore.export(db, os.path.join(index_path, "mmap"))
+        # Keyword index over the same chunks for hybrid search
+        BM25Index.from_faiss(db).save(os.path.join(index_path, "bm25.json"))
+
+        for name in removed:
+            manifest.remove_file(name)
+        for name in changed_names:
+            manifest.update_file(name, hashes[name], file_ids[name])
+        manifest.save()
+
+        return db
+
+    def load_search_store(self, index_path="faiss_index"):
+        # Near-instant, page-cache-shared store for processes that only search: vectors are
+        # memory-mapped and chunk texts are read from disk only for the returned hits
+        return MmapVectorStore.load(os.path.join(index_path, "mmap"), self.embeddings)
+
+    def load_bm25_index(self, index_path="faiss_index"):
+        return BM25Index.load(os.path.join(index_path, "bm25.json"))
+
 class DocumentSearch:
-    def __init__(self, embedding_db):
+    def __init__(self, embedding_db, bm25_index=None, reranker_model=None, stage_budgets=None):
         # Initialize DocumentSearch with an embedding database
         self.embedding_db = embedding_db
+        # Hybrid search needs the BM25 index built next to the FAISS index; reranking is optional,
+        # e.g. reranker_model="cross-encoder/ms-marco-MiniLM-L-6-v2", stage_budgets={"rerank": 0.2}
+        self.hybrid_retriever = None
+        if bm25_index is not None:
+            self.hybrid_retriever = HybridRetriever(embedding_db, bm25_index, reranker_model=reranker_model, stage_budgets=stage_budgets)
     
-    def search_similarity(self, query, k=5):
+    def search_similarity(self, query, k=5, nprobe=None, ef_search=None):
         # Perform similarity search on the embedding database
-        return self.embedding_db.similarity_search(query, k=k)
+        # nprobe (IVF) and ef_search (HNSW) trade recall for latency on approximate indexes
+        if (nprobe is not None or ef_search is not None) and self.embedding_db.index is not None:
+            set_search_params(self.embedding_db.index, nprobe=nprobe, ef_search=ef_search)
+        with stage("retrieve", mode="dense") as record:
+            results = self.embedding_db.similarity_search(query, k=k)
+            record["docs"] = len(results)
+        return results
+
+    def hybrid_search(self, query, k=5, candidates=20):
+        # Dense + BM25 results fused with reciprocal rank fusion, then optionally reranked.
+        # Keyword-heavy queries (section titles, scheme names) get better chunks, so fewer are needed.
+        if self.hybrid_retriever is None:
+            # No BM25 index was passed, e.g. an index built before hybrid search: dense results only
+            return self.search_similarity(query, k=k)
+        self.hybrid_retriever.candidates = candidates
+        with stage("retrieve", mode="hybrid") as record:
+            results = self.hybrid_retriever.search(query, k=k)
+            record["docs"] = len(results)
+            # dense / bm25 / fuse / rerank seconds of this search
+            record.update({f"{name}_seconds": round(seconds, 6) for name, seconds in self.hybrid_retriever.last_timings.items() if name != "total"})
+        return results
     
     def get_similarity_metadata(self, results):
         src_meta_list = []
@@ -72,32 +262,56 @@ if __name__ == "__main__":
     openai_config = OpenAIConfig(api_key, api_base)
     
     # Initialize ChatOpenAI model
-    chat_model =  ChatOpenAI(temperature=0.0, model_kwargs={"engine": "GPT3-5"}, headers={
+    chat_model = get_chat_model(temperature=0.0, headers={
                             "Helicone-Auth": "Bearer sk-helicone-jocztra-rzquezq-vupgixi-ovqylny",
                             "Helicone-User-Id": "Abhishek.Yadav"})
     
     # Initialize DocumentProcessor with PDF path
     document_processor = DocumentProcessor('./input/')
-    docs = document_processor.split_documents()
     
     # Initialize EmbeddingProcessor with model name
     embedding_processor = EmbeddingProcessor(model_name="all-MiniLM-L6-v2")
-    # Create embedding database using documents and instructor embeddings
-    faiss_vector_store = embedding_processor.create_embedding_database(docs)
     
-    # Initialize DocumentSearch with embedding database
-    search_processor = DocumentSearch(embedding_db=faiss_vector_store)
+    # Per-stage wall time, tokens and sizes of every request, sampled per TRACE_SAMPLE_RATE
+    metrics = PrometheusExporter()
+    tracer = Tracer.from_env([JSONLExporter("traces.jsonl"), metrics])
     
+    # Sync the embedding database with the input directory, embedding only new or changed chunks
+    with tracer.trace("ingest"):
+        faiss_vector_store = embedding_processor.update_embedding_database(document_processor)
+    if faiss_vector_store is None:
+        sys.exit("no PDFs with text in ./input/, nothing to search")
+    
+    # Initialize DocumentSearch with embedding database and the keyword index built alongside it
+    search_processor = DocumentSearch(embedding_db=faiss_vector_store, bm25_index=embedding_processor.load_bm25_index())
+    
+    
+    # Answers to repeated questions over the same chunks are served from disk without an LLM call
+    answer_cache = AnswerCache(embeddings=embedding_processor.embeddings)
+    query = "What is discussed about LEGISLATIVE CHANGES IN GST LAWS"
+    
+    # Deduplicates and stitches overlapping chunks, then fills a prompt token budget by relevance
+    context_packer = ContextPacker(token_budget=1200)
     
     # Print search results
     chain = load_qa_chain(chat_model, chain_type="stuff")
     
-    # Perform similarity search on the database
-    results = search_processor.search_similarity("What is discussed about LEGISLATIVE CHANGES IN GST LAWS", k=5)
-    
-    similarity_results_src = search_processor.get_similarity_metadata(results)
-    print(similarity_results_src)
-    print(chain.run(input_documents=results, question=results))
+    with tracer.trace("query", query_chars=len(query)) as trace:
+        # Perform similarity search on the database
+        results = search_processor.hybrid_search(query, k=5)
+        
+        similarity_results_src = search_processor.get_similarity_metadata(results)
+        print(similarity_results_src)
+        with stage("cache_lookup"):
+            answer = answer_cache.lookup(query, results)
+        if answer is None:
+            with stage("pack") as record:
+                packed_results, packing_report = context_packer.pack(results)
+                record.update(packing_report)
+            print(packing_report)
+            answer = chain.run(input_documents=packed_results, question=query, callbacks=trace.callbacks)
+            answer_cache.store(query, results, answer)
+    print(answer)
     
     
     
@@ -105,12 +319,25 @@ if __name__ == "__main__":
     # Print search results
     chain = load_qa_chain(chat_model, chain_type="stuff")
     
-    # Perform similarity search on the database
-    results = search_processor.search_similarity("What is discussed about LEGISLATIVE CHANGES IN GST LAWS", k=5)
+    with tracer.trace("query", query_chars=len(query)) as trace:
+        # Perform similarity search on the database
+        results = search_processor.hybrid_search(query, k=5)
+        
+        similarity_results_src = search_processor.get_similarity_metadata(results)
+        print(similarity_results_src)
+        with stage("cache_lookup"):
+            answer = answer_cache.lookup(query, results)
+        if answer is None:
+            with stage("pack") as record:
+                packed_results, packing_report = context_packer.pack(results)
+                record.update(packing_report)
+            print(packing_report)
+            answer = chain.run(input_documents=packed_results, question=query, callbacks=trace.callbacks)
+            answer_cache.store(query, results, answer)
+    print(answer)
     
-    similarity_results_src = search_processor.get_similarity_metadata(results)
-    print(similarity_results_src)
-    print(chain.run(input_documents=results, question=results))
+    # Stage latency histograms and token counters, for the node_exporter textfile collector
+    metrics.write("metrics.prom")
     
     
     
\ No newline at end of file
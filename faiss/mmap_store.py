@@ -0,0 +1,124 @@
+import os
+import json
+import shutil
+import sqlite3
+
+import numpy as np
+import faiss
+from langchain.docstore.document import Document
+
+VECTORS_FILE = "vectors.npy"
+NORMS_FILE = "norms.npy"
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+
+
+class MmapVectorStore:
+    # Read-only search store for a saved FAISS index. Chunk texts/metadata sit in an indexed sqlite
+    # file that is only read for the rows a search returns. Vectors of flat and IVF indexes are
+    # memory-mapped, so processes share them through the page cache and loading costs a few file
+    # opens. FAISS can only map IVF inverted lists: HNSW and SQ8 indexes are read fully into RAM
+    # by every process (memory_mapped is False for them).
+
+    def __init__(self, path, embeddings):
+        self.path = path
+        self.embeddings = embeddings
+        self.index = None
+        self.vectors = None
+        self.norms = None
+        self.memory_mapped = True
+
+        if os.path.exists(os.path.join(path, VECTORS_FILE)):
+            # Exact flat search straight over the mapped file
+            self.vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+            self.norms = np.load(os.path.join(path, NORMS_FILE), mmap_mode="r")
+        else:
+            # Approximate indexes go through FAISS. Only the inverted lists of IVF indexes (the bulk of
+            # their size) are mapped; the flag is ignored for HNSW and SQ8, which are read into RAM
+            self.index = faiss.read_index(os.path.join(path, INDEX_FILE), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            self.memory_mapped = faiss.try_extract_index_ivf(self.index) is not None
+
+        self.conn = sqlite3.connect(f"file:{os.path.join(path, DOCSTORE_FILE)}?mode=ro", uri=True, check_same_thread=False)
+
+    @classmethod
+    def load(cls, path, embeddings):
+        return cls(path, embeddings)
+
+    @staticmethod
+    def export(db, path):
+        # Write a langchain FAISS store in the mmap layout. Files are built in a temp directory
+        # and swapped in at the end so readers never see a half-written store.
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        index = faiss.downcast_index(db.index)
+        if isinstance(index, faiss.IndexFlat):
+            vectors = index.reconstruct_n(0, index.ntotal).astype(np.float32)
+            np.save(os.path.join(tmp_path, VECTORS_FILE), vectors)
+            np.save(os.path.join(tmp_path, NORMS_FILE), (vectors ** 2).sum(axis=1))
+        else:
+            faiss.write_index(db.index, os.path.join(tmp_path, INDEX_FILE))
+
+        conn = sqlite3.connect(os.path.join(tmp_path, DOCSTORE_FILE))
+        conn.execute("CREATE TABLE chunks (position INTEGER PRIMARY KEY, doc_id TEXT NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL)")
+        rows = []
+        for position, doc_id in db.index_to_docstore_id.items():
+            doc = db.docstore.search(doc_id)
+            rows.append((position, doc_id, doc.page_content, json.dumps(doc.metadata)))
+        conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows)
+        conn.execute("CREATE INDEX chunks_doc_id ON chunks (doc_id)")
+        conn.commit()
+        conn.close()
+
+        old_path = path + ".old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def _search_vectors(self, query_vector, k):
+        if self.index is not None:
+            distances, positions = self.index.search(query_vector.reshape(1, -1), k)
+            return [(int(position), float(distance)) for position, distance in zip(positions[0], distances[0]) if position != -1]
+
+        # Squared L2 distance, matching the IndexFlatL2 scores of the langchain store
+        distances = self.norms - 2 * (self.vectors @ query_vector) + query_vector @ query_vector
+        k = min(k, len(distances))
+        top = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+        top = top[np.argsort(distances[top])]
+        return [(int(position), float(distances[position])) for position in top]
+
+    def _fetch(self, positions):
+        placeholders = ",".join("?" * len(positions))
+        rows = self.conn.execute(f"SELECT position, text, metadata FROM chunks WHERE position IN ({placeholders})", positions).fetchall()
+        return {position: Document(page_content=text, metadata=json.loads(metadata)) for position, text, metadata in rows}
+
+    def similarity_search_ids(self, query, k=4):
+        # [(docstore id, distance)] without reading any chunk text
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        hits = self._search_vectors(query_vector, k)
+        if not hits:
+            return []
+        placeholders = ",".join("?" * len(hits))
+        doc_ids = dict(self.conn.execute(f"SELECT position, doc_id FROM chunks WHERE position IN ({placeholders})", [position for position, _ in hits]).fetchall())
+        return [(doc_ids[position], distance) for position, distance in hits]
+
+    def get_documents(self, doc_ids):
+        if not doc_ids:
+            return {}
+        placeholders = ",".join("?" * len(doc_ids))
+        rows = self.conn.execute(f"SELECT doc_id, text, metadata FROM chunks WHERE doc_id IN ({placeholders})", list(doc_ids)).fetchall()
+        return {doc_id: Document(page_content=text, metadata=json.loads(metadata)) for doc_id, text, metadata in rows}
+
+    def similarity_search_with_score(self, query, k=4):
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        hits = self._search_vectors(query_vector, k)
+        if not hits:
+            return []
+        docs = self._fetch([position for position, _ in hits])
+        return [(docs[position], distance) for position, distance in hits]
+
+    def similarity_search(self, query, k=4):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k)]
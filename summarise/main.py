@@ -1,11 +1,21 @@
 import os
-import openai
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from langchain.chat_models import ChatOpenAI
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.document_loaders import PyPDFLoader
+from langchain.docstore.document import Document
+from langchain.chains import LLMChain
 from langchain.chains.summarize import load_summarize_chain
+from langchain.chains.summarize.map_reduce_prompt import PROMPT as MAP_PROMPT
 from helicone.openai_proxy import openai
+from summary_cache import SummaryCache, content_hash
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.clients import configure_openai, get_chat_model
+from common.llm_cache import install_llm_cache
+from common.text_splitter import StructuredTextSplitter
 
 
 # Load environment variables from .env file
@@ -13,21 +23,28 @@ load_dotenv()
 
 
 class FileSummarizer:
-    def __init__(self, file_path):
+    def __init__(self, file_path, cache_path=".summary_cache.sqlite"):
         self.file_path = file_path
-        self.config_azure_api()'
-        self.chat_model = ChatOpenAI(temperature=0.0, model_kwargs={"engine": "GPT3-5"}, headers={
+        # Chunk and reduce summaries persist across runs, keyed by chunk hash + prompt + model
+        self.cache = SummaryCache(cache_path)
+        # Chunks end at headings and numbered paragraphs first; the parsed PDF is cached in .document_cache/
+        self.text_splitter = StructuredTextSplitter(chunk_size=1000, chunk_overlap=100)
+        self.config_azure_api()
+        # Prompt-level cache under the summary cache: also covers the refine and stuff chains
+        self.llm_cache = install_llm_cache()
+        self.chat_model = get_chat_model(temperature=0.0, headers={
                             "Helicone-Auth": "Bearer sk-helicone-jocztra-rzquezq-vupgixi-ovqylny",
                             "Helicone-User-Id": "Abhishek.Yadav"})
-                                
+        # Wall-clock seconds of each stage of the last summarization run
+        self.timings = {}
+        # LLM calls made and summaries served from the cache in the last run
+        self.stats = {"llm_calls": 0, "cache_hits": 0}
+        self.stats_lock = threading.Lock()
         
     def config_azure_api(self):
         
-        # Set up OpenAI API configuration
-        openai.api_base = os.getenv("OPENAI_API_BASE")
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-        openai.api_version = "2023-05-15"
-        openai.api_type = "azure"
+        # Set up OpenAI API configuration, once per process
+        configure_openai()
 
     def file_loader(self):
         # Load the PDF file using PyPDFLoader
@@ -40,18 +57,33 @@ class FileSummarizer:
         return pages_content_list
     
     def splitter(self, pages_content_list):
-        # Split text into chunks using RecursiveCharacterTextSplitter
-        text_splitter = RecursiveCharacterTextSplitter(
-            separators="\n",
-            chunk_size=1000,
-            chunk_overlap=100,
-            length_function=len
-        )
-        texts = text_splitter.create_documents(pages_content_list)
+        # Split the pages into chunks as one text, so a paragraph running over a page break stays whole
+        texts = self.text_splitter.split_documents(
+            [Document(page_content=text, metadata={"source": self.file_path, "page": page}) for page, text in enumerate(pages_content_list)])
 
         return texts
+
+    def load_chunks(self):
+        # Chunk texts of the PDF; the PDF is parsed only when its bytes changed (.document_cache/)
+        return [doc.page_content for doc in self.text_splitter.split_file(self.file_path)]
+
+    def model_id(self):
+        return f"{self.chat_model.model_name}/{self.chat_model.model_kwargs.get('engine', '')}/{self.chat_model.temperature}"
+
+    def summarize(self, chain, text):
+        # One summary per (model, prompt, text), so unchanged chunks and reduce groups are never re-run
+        key = content_hash(self.model_id(), chain.prompt.template, text)
+        summary = self.cache.get_summary(key)
+        cached = summary is not None
+        if not cached:
+            summary = chain.run(text=text)
+            self.cache.put_summary(key, summary)
+
+        with self.stats_lock:
+            self.stats["cache_hits" if cached else "llm_calls"] += 1
+        return summary
         
-    def map_reduce_summary(self):
+    def refine_summary(self):
         # Load content from the file and split into chunks
         pages_content_list = self.file_loader()
         texts = self.splitter(pages_content_list)
@@ -59,14 +91,90 @@ class FileSummarizer:
         # Load the summarize chain
         chain = load_summarize_chain(self.chat_model, chain_type="refine")
         
-        # Run the chain on the first two chunks
+        # Run the chain on the first five chunks, one sequential LLM call per chunk
         print(chain.run(texts[0:5]))
 
-# Path to the PDF file
-file_path = "./input/budget_speech.pdf"
+    def group_by_tokens(self, summaries, token_budget, boundary_every=8):
+        # Pack consecutive summaries into groups that fit the token budget of one reduce prompt.
+        # A group also ends after any summary whose hash is divisible by boundary_every, so after an
+        # edit the group boundaries shift only up to the next such content-defined boundary and the
+        # cached reduce steps of the other groups stay valid.
+        groups = [[]]
+        group_tokens = 0
+        for summary in summaries:
+            tokens = self.chat_model.get_num_tokens(summary)
+            if groups[-1] and group_tokens + tokens > token_budget:
+                groups.append([])
+                group_tokens = 0
+            groups[-1].append(summary)
+            group_tokens += tokens
+            if int(content_hash(summary), 16) % boundary_every == 0:
+                groups.append([])
+                group_tokens = 0
+        return [group for group in groups if group]
+
+    def fold_summaries(self, chain, summaries, token_budget):
+        # Final reduce step: folds the summaries into a running summary, as many at a time as fit the
+        # token budget next to it, so no reduce prompt exceeds token_budget. With a single group this
+        # is one call over the whole group, as before
+        counts = [self.chat_model.get_num_tokens(summary) for summary in summaries]
+        summary = None
+        start = 0
+        while start < len(summaries):
+            used = self.chat_model.get_num_tokens(summary) if summary is not None else 0
+            end = start
+            while end < len(summaries) and used + counts[end] <= token_budget:
+                used += counts[end]
+                end += 1
+            if end == start:
+                raise ValueError(f"summary of {counts[start]} tokens does not fit token_budget={token_budget} "
+                                 f"next to a running summary of {used} tokens; raise token_budget")
+            summary = self.summarize(chain, "\n\n".join(([summary] if summary is not None else []) + summaries[start:end]))
+            start = end
+        return summary
+
+    def map_reduce_summary(self, max_workers=8, token_budget=3000, max_levels=5):
+        # Summarize every chunk concurrently, then combine the summaries level by level in
+        # token-budgeted groups, also concurrently, until a single reduce call is left
+        self.timings = {}
+        self.stats = {"llm_calls": 0, "cache_hits": 0}
+
+        start = time.perf_counter()
+        texts = self.load_chunks()
+        self.timings["load_split"] = time.perf_counter() - start
+
+        map_chain = LLMChain(llm=self.chat_model, prompt=MAP_PROMPT)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            start = time.perf_counter()
+            summaries = list(executor.map(lambda text: self.summarize(map_chain, text), texts))
+            self.timings["map"] = time.perf_counter() - start
+
+            level = 0
+            while True:
+                start = time.perf_counter()
+                groups = self.group_by_tokens(summaries, token_budget)
+                if len(groups) == 1 or level + 1 >= max_levels:
+                    # Out of levels with several groups left, the rest is folded in within the budget
+                    summary = self.fold_summaries(map_chain, summaries, token_budget)
+                    self.timings["reduce_final"] = time.perf_counter() - start
+                    return summary
+
+                summaries = list(executor.map(lambda group: self.summarize(map_chain, "\n\n".join(group)), groups))
+                self.timings[f"reduce_level_{level}"] = time.perf_counter() - start
+                level += 1
+
+if __name__ == "__main__":
+    # Path to the PDF file
+    file_path = "./input/budget_speech.pdf"
+
+    # Create a FileSummarizer instance
+    summarizer = FileSummarizer(file_path)
 
-# Create a FileSummarizer instance
-summarizer = FileSummarizer(file_path)
+    # Call the map_reduce_summary method to generate summaries
+    print(summarizer.map_reduce_summary())
 
-# Call the map_reduce_summary method to generate summaries
-summarizer.map_reduce_summary()
+    for stage, seconds in summarizer.timings.items():
+        print(f"{stage}: {seconds:.2f}s")
+    print(summarizer.stats)
+    print(summarizer.llm_cache.metrics())
@@ -0,0 +1,33 @@
+import sqlite3
+import hashlib
+import threading
+
+
+def content_hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class SummaryCache:
+    # On-disk store of chunk and reduce-step summaries keyed by hash(model, prompt, input text).
+    # Every summary is committed as soon as it exists, so an interrupted run resumes where it stopped.
+
+    def __init__(self, path=".summary_cache.sqlite"):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT NOT NULL)")
+        self.conn.commit()
+
+    def get_summary(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put_summary(self, key, summary):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO summaries (key, summary) VALUES (?, ?)", (key, summary))
+            self.conn.commit()
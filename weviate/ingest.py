@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import threading
+
+from weaviate.util import generate_uuid5
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.hashing import assign_chunk_ids
+from common.tracing import stage
+
+
+def chunk_uuid(doc, seen=None):
+    #deterministic object id from the chunk's file path, text and occurrence in that file (the same
+    #chunk id the faiss pipeline uses), re-ingesting a chunk overwrites itself. pass one seen dict
+    #for all chunks of an ingest, so repeated chunks of a file get their own objects
+    return generate_uuid5(assign_chunk_ids([doc], seen)[0])
+
+
+class WeaviateIngestor:
+    #bulk, idempotent loader for pdf chunks. chunks already stored under their content uuid are
+    #skipped, new ones are embedded in batches and uploaded through the client's dynamic batching.
+
+    def __init__(self, client, embeddings, class_name, text_key="text", batch_size=100, num_workers=2, dynamic=True, embed_batch_size=256):
+        self.client = client
+        self.embeddings = embeddings
+        self.class_name = class_name
+        self.text_key = text_key
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.dynamic = dynamic
+        self.embed_batch_size = embed_batch_size
+        self.lock = threading.Lock()
+        self.failed = []
+
+    def ensure_class(self):
+        #creates the class once instead of a fresh LangChain_<uuid> class per run
+        if self.client.schema.exists(self.class_name):
+            return
+        self.client.schema.create_class({
+            "class": self.class_name,
+            "vectorizer": "none",
+            "properties": [
+                {"name": self.text_key, "dataType": ["text"]},
+                {"name": "source", "dataType": ["text"]},
+                {"name": "page", "dataType": ["int"]},
+            ],
+        })
+
+    def existing_ids(self, page_size=1000):
+        #walks the class with the cursor api, asking for _additional { id } only so no properties are transferred
+        ids = set()
+        after = None
+        while True:
+            query = self.client.query.get(self.class_name).with_additional(["id"]).with_limit(page_size)
+            if after is not None:
+                query = query.with_after(after)
+            result = query.do()
+            if "errors" in result:
+                raise RuntimeError(f"listing {self.class_name} ids failed: {result['errors']}")
+            objects = result["data"]["Get"][self.class_name]
+            if not objects:
+                return ids
+            ids.update(obj["_additional"]["id"] for obj in objects)
+            after = objects[-1]["_additional"]["id"]
+
+    def on_batch_result(self, results):
+        #called by the client after every flushed batch
+        for result in results or []:
+            errors = result.get("result", {}).get("errors")
+            if errors:
+                with self.lock:
+                    self.failed.append({"id": result.get("id"), "errors": errors})
+
+    def upload(self, batch, pending):
+        vectors = self.embeddings.embed_documents([doc.page_content for _, doc in pending])
+        #full batches are flushed to weaviate from inside add_data_object
+        with stage("upsert", objects=len(pending)):
+            for (uuid, doc), vector in zip(pending, vectors):
+                properties = {self.text_key: doc.page_content, "source": str(doc.metadata.get("source", "")), "page": int(doc.metadata.get("page", 0))}
+                batch.add_data_object(properties, self.class_name, uuid=uuid, vector=vector)
+
+    def ingest(self, documents):
+        #documents can be a list or the chunk generator of load_documents_create_chunks(stream=True)
+        start = time.perf_counter()
+        self.failed = []
+        self.ensure_class()
+        existing = self.existing_ids()
+
+        seen = skipped = uploaded = 0
+        pending = []
+        queued = set()
+        occurrences = {}
+
+        self.client.batch.configure(batch_size=self.batch_size, dynamic=self.dynamic, num_workers=self.num_workers, callback=self.on_batch_result)
+        with self.client.batch as batch:
+            for doc in documents:
+                seen += 1
+                uuid = chunk_uuid(doc, occurrences)
+                if uuid in existing or uuid in queued:
+                    skipped += 1
+                    continue
+                queued.add(uuid)
+                pending.append((uuid, doc))
+                if len(pending) >= self.embed_batch_size:
+                    self.upload(batch, pending)
+                    uploaded += len(pending)
+                    pending = []
+            if pending:
+                self.upload(batch, pending)
+                uploaded += len(pending)
+
+        seconds = time.perf_counter() - start
+        return {
+            "chunks": seen,
+            "skipped_existing": skipped,
+            "uploaded": uploaded - len(self.failed),
+            "failed": len(self.failed),
+            "seconds": seconds,
+            "objects_per_second": uploaded / seconds if seconds else 0.0,
+        }
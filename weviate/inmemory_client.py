@@ -0,0 +1,180 @@
+import copy
+import uuid as uuid_lib
+
+import numpy as np
+
+
+#in-process stand-in for the subset of weaviate.Client used by LangChainApp, WeaviateIngestor and
+#VectorRetriever. lets ingestion and retrieval run in tests and benchmarks
+#without a weaviate server.
+
+class _Schema:
+    def __init__(self, client):
+        self.client = client
+
+    def exists(self, class_name):
+        return class_name in self.client.classes
+
+    def create_class(self, class_obj):
+        if class_obj["class"] in self.client.classes:
+            raise ValueError(f"class {class_obj['class']} already exists")
+        self.client.classes[class_obj["class"]] = copy.deepcopy(class_obj)
+        self.client.objects[class_obj["class"]] = {}
+
+    def get(self, class_name=None):
+        if class_name is not None:
+            return copy.deepcopy(self.client.classes[class_name])
+        return {"classes": [copy.deepcopy(class_obj) for class_obj in self.client.classes.values()]}
+
+    def delete_class(self, class_name):
+        self.client.classes.pop(class_name, None)
+        self.client.objects.pop(class_name, None)
+
+    def delete_all(self):
+        self.client.classes.clear()
+        self.client.objects.clear()
+
+
+class _Batch:
+    def __init__(self, client):
+        self.client = client
+        self.batch_size = 100
+        self.callback = None
+        self.pending = []
+
+    def configure(self, batch_size=100, dynamic=False, num_workers=1, callback=None, **kwargs):
+        self.batch_size = batch_size or 100
+        self.callback = callback
+        return self
+
+    def add_data_object(self, data_object, class_name, uuid=None, vector=None, **kwargs):
+        self.pending.append((class_name, str(uuid or uuid_lib.uuid4()), copy.deepcopy(data_object), vector))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        results = []
+        for class_name, object_id, properties, vector in self.pending:
+            if class_name not in self.client.objects:
+                results.append({"id": object_id, "result": {"errors": {"error": [{"message": f"class {class_name} not found"}]}}})
+                continue
+            #same uuid replaces the stored object, like a batch upsert on a real server
+            self.client.objects[class_name][object_id] = {"properties": properties, "vector": np.asarray(vector, dtype=np.float32)}
+            results.append({"id": object_id, "result": {}})
+        self.pending = []
+        if self.callback is not None:
+            self.callback(results)
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+class _DataObject:
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, uuid=None, class_name=None, limit=None, after=None, with_vector=False, **kwargs):
+        objects = self.client.objects.get(class_name, {})
+        ids = sorted(objects)
+        if uuid is not None:
+            ids = [object_id for object_id in ids if object_id == str(uuid)]
+        if after is not None:
+            ids = [object_id for object_id in ids if object_id > after]
+        if limit is not None:
+            ids = ids[:limit]
+        return {"objects": [{"id": object_id, "class": class_name, "properties": copy.deepcopy(objects[object_id]["properties"])} for object_id in ids]}
+
+    def delete(self, uuid, class_name=None, **kwargs):
+        self.client.objects.get(class_name, {}).pop(str(uuid), None)
+
+
+class _GetQuery:
+    def __init__(self, client, class_name, properties):
+        self.client = client
+        self.class_name = class_name
+        self.properties = properties
+        self.vector = None
+        self.limit = None
+        self.after = None
+        self.where = None
+        self.additional = []
+
+    def with_near_vector(self, content):
+        self.vector = np.asarray(content["vector"], dtype=np.float32)
+        return self
+
+    def with_limit(self, limit):
+        self.limit = limit
+        return self
+
+    def with_additional(self, properties):
+        self.additional = [properties] if isinstance(properties, str) else list(properties)
+        return self
+
+    def with_after(self, uuid):
+        #cursor api: objects in id order, starting after the given id
+        self.after = str(uuid)
+        return self
+
+    def with_where(self, content):
+        #Equal and And only, e.g. a VectorRetriever.where_filter on source and page
+        self.where = content
+        return self
+
+    def _matches(self, properties, where):
+        operator = where.get("operator")
+        if operator == "And":
+            return all(self._matches(properties, operand) for operand in where["operands"])
+        if operator == "Equal":
+            value_keys = [key for key in where if key.startswith("value")]
+            if len(value_keys) != 1:
+                raise ValueError(f"Equal filter needs exactly one value: {where}")
+            return properties.get(where["path"][-1]) == where[value_keys[0]]
+        raise ValueError(f"where operator {operator!r} is not supported by the in-memory client")
+
+    def do(self):
+        objects = sorted(self.client.objects.get(self.class_name, {}).items())
+        if self.after is not None:
+            objects = [(object_id, obj) for object_id, obj in objects if object_id > self.after]
+        if self.where is not None:
+            objects = [(object_id, obj) for object_id, obj in objects if self._matches(obj["properties"], self.where)]
+        hits = []
+        if objects and self.vector is not None:
+            #cosine distance, weaviate's default metric
+            matrix = np.stack([obj["vector"] for _, obj in objects])
+            scores = matrix @ self.vector / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(self.vector) + 1e-12)
+            order = np.argsort(-scores)[:self.limit]
+            hits = [(objects[i], 1.0 - float(scores[i])) for i in order]
+        else:
+            hits = [(obj, None) for obj in objects[:self.limit]]
+
+        rows = []
+        for (object_id, obj), distance in hits:
+            row = {name: obj["properties"].get(name) for name in self.properties}
+            if self.additional:
+                additional = {"id": object_id, "distance": distance}
+                row["_additional"] = {name: additional.get(name) for name in self.additional}
+            rows.append(row)
+        return {"data": {"Get": {self.class_name: rows}}}
+
+
+class _Query:
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, class_name, properties=None):
+        return _GetQuery(self.client, class_name, properties or [])
+
+
+class InMemoryWeaviateClient:
+    def __init__(self):
+        self.classes = {}
+        self.objects = {}
+        self.schema = _Schema(self)
+        self.batch = _Batch(self)
+        self.data_object = _DataObject(self)
+        self.query = _Query(self)
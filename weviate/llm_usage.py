@@ -1,47 +1,135 @@
 import os
 import json
+import sqlite3
 import datetime
+import threading
+
+class CachedUsage:
+    # Usage of a query answered from the answer cache: no tokens, no cost
+    total_tokens = 0
+    prompt_tokens = 0
+    completion_tokens = 0
+    total_cost = 0.0
+
+#aggregate key used in the totals table for "all users" / "all models"
+ALL = "*"
 
 class UsageUpdater:
+    #append-only usage ledger in sqlite (WAL mode, so many processes can write safely).
+    #running totals per day, user and model are updated in the same transaction as each
+    #entry, which keeps cost lookups O(1). export_json writes the old <date>_usage.json shape.
+
+    def __init__(self, output_dir="output", user=ALL, model=ALL):
+        self.output_dir = output_dir
+        self.user = user
+        self.model = model
+        self.lock = threading.Lock()
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        self.conn = sqlite3.connect(os.path.join(output_dir, "usage.sqlite"), timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS usage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            day TEXT NOT NULL,
+            time TEXT NOT NULL,
+            user TEXT NOT NULL,
+            model TEXT NOT NULL,
+            total_tokens INTEGER NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            cost REAL NOT NULL)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS usage_day ON usage (day)")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS totals (
+            day TEXT NOT NULL,
+            user TEXT NOT NULL,
+            model TEXT NOT NULL,
+            queries INTEGER NOT NULL,
+            total_tokens INTEGER NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            cost REAL NOT NULL,
+            PRIMARY KEY (day, user, model))""")
+
+    def update_usage(self, details, user=None, model=None):
+        now = datetime.datetime.now()
+        day = now.strftime("%Y-%m-%d")
+        user = user or self.user
+        model = model or self.model
+        values = (details.total_tokens, details.prompt_tokens, details.completion_tokens, details.total_cost)
+
+        with self.lock:
+            #BEGIN IMMEDIATE takes the database write lock up front, so concurrent writers queue instead of failing
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(
+                    "INSERT INTO usage (day, time, user, model, total_tokens, prompt_tokens, completion_tokens, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (day, now.strftime("%H:%M:%S"), user, model) + values)
+                for total_user, total_model in {(user, model), (user, ALL), (ALL, model), (ALL, ALL)}:
+                    self.conn.execute("""INSERT INTO totals VALUES (?, ?, ?, 1, ?, ?, ?, ?)
+                        ON CONFLICT (day, user, model) DO UPDATE SET
+                            queries = queries + 1,
+                            total_tokens = total_tokens + excluded.total_tokens,
+                            prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                            completion_tokens = completion_tokens + excluded.completion_tokens,
+                            cost = cost + excluded.cost""", (day, total_user, total_model) + values)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
 
-    def update_usage(self, details):
-        current_time = datetime.datetime.now().strftime("%H:%M:%S")
-
-        usage_dict = {
-            "Total Tokens": details.total_tokens,
-            "Prompt Tokens": details.prompt_tokens,
-            "Completion Tokens": details.completion_tokens,
-            "Total Cost (USD)": details.total_cost,
-            "Time Stamp": current_time
-        }
-        
-
-        current_date = datetime.datetime.now().strftime("%d-%m-%Y")
-        file_name = f"{current_date}_usage.json"
-
-        if not os.path.exists("output"):
-            os.makedirs("output")
-
-        self.json_file_path = os.path.join("output", file_name)
-
-        if os.path.exists(self.json_file_path):
-            with open(self.json_file_path, "r") as file:
-                existing_data = json.load(file)
-                existing_data["day_cost"] += usage_dict["Total Cost (USD)"] 
-                existing_data["usage_track"].append(usage_dict)
-            with open(self.json_file_path, "w") as file:
-                json.dump(existing_data, file, indent=4)
-            #print(f"Data appended to '{self.json_file_path}'.")
-        else:
-            with open(self.json_file_path, "w") as file:
-                json.dump({ "usage_track": [usage_dict], "day_cost": usage_dict["Total Cost (USD)"] }, file, indent=4)
-            #print(f"File '{self.json_file_path}' created and data written.")
-
-    def get_daily_usage(self):
-        if os.path.exists(self.json_file_path):
-            with open(self.json_file_path, "r") as file:
-                existing_data = json.load(file)
-                return existing_data["day_cost"]
-        else:
+    def record_cache_hit(self, user=None, model=None):
+        self.update_usage(CachedUsage(), user=user, model=model)
+
+    def get_totals(self, day=None, user=ALL, model=ALL):
+        day = day or datetime.date.today().strftime("%Y-%m-%d")
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT queries, total_tokens, prompt_tokens, completion_tokens, cost FROM totals WHERE day = ? AND user = ? AND model = ?",
+                (day, user, model)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(["Queries", "Total Tokens", "Prompt Tokens", "Completion Tokens", "Total Cost (USD)"], row))
+
+    def get_daily_usage(self, day=None):
+        totals = self.get_totals(day)
+        if totals is None:
             print("No usage as of todays record.")
-        
\ No newline at end of file
+            return None
+        return totals["Total Cost (USD)"]
+
+    def get_user_usage(self, user, day=None):
+        return self.get_totals(day, user=user)
+
+    def get_model_usage(self, model, day=None):
+        return self.get_totals(day, model=model)
+
+    def export_json(self, day=None):
+        #writes output/<dd-mm-yyyy>_usage.json in the original {"usage_track": [...], "day_cost": ...} shape
+        day = day or datetime.date.today().strftime("%Y-%m-%d")
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT total_tokens, prompt_tokens, completion_tokens, cost, time FROM usage WHERE day = ? ORDER BY id", (day,)).fetchall()
+        if not rows:
+            return None
+
+        usage_track = [dict(zip(["Total Tokens", "Prompt Tokens", "Completion Tokens", "Total Cost (USD)", "Time Stamp"], row)) for row in rows]
+        file_name = datetime.datetime.strptime(day, "%Y-%m-%d").strftime("%d-%m-%Y") + "_usage.json"
+        self.json_file_path = os.path.join(self.output_dir, file_name)
+        with open(self.json_file_path, "w") as file:
+            json.dump({"usage_track": usage_track, "day_cost": sum(row[3] for row in rows)}, file, indent=4)
+        return self.json_file_path
+
+    def compact(self, keep_days=30):
+        #exports every day older than keep_days to json and drops its ledger entries; totals stay queryable
+        cutoff = (datetime.date.today() - datetime.timedelta(days=keep_days)).strftime("%Y-%m-%d")
+        with self.lock:
+            days = [row[0] for row in self.conn.execute("SELECT DISTINCT day FROM usage WHERE day < ?", (cutoff,)).fetchall()]
+        for day in days:
+            self.export_json(day)
+            with self.lock:
+                self.conn.execute("DELETE FROM usage WHERE day = ?", (day,))
+        with self.lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return days
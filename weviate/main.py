@@ -1,33 +1,57 @@
 import os
+import sys
+import time
+import random
+import asyncio
 from dotenv import load_dotenv
 from llm_usage import UsageUpdater
 
 import openai
 import weaviate
-from langchain.chat_models import ChatOpenAI
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import HuggingFaceEmbeddings
+from openai.error import RateLimitError
 from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
 from langchain.memory import ConversationBufferWindowMemory
 from langchain.vectorstores import Weaviate
 from langchain.document_loaders import DirectoryLoader, PyPDFLoader
 from helicone.openai_proxy import openai
 from langchain.callbacks import get_openai_callback
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.clients import configure_openai, get_chat_model
+from common.pdf_loader import ParallelPDFLoader
+from common.embeddings import CachedEmbeddings
+from common.answer_cache import AnswerCache
+from common.streaming import TokenStreamHandler, TokenStream
+from common.tracing import Tracer, JSONLExporter, PrometheusExporter, stage, activate
+from common.text_splitter import StructuredTextSplitter
+from ingest import WeaviateIngestor
+from retriever import VectorRetriever
+
 
 class LangChainApp:
-    def __init__(self):
+    #weaviate_client can be passed in, e.g. an InMemoryWeaviateClient in tests and benchmarks
+    #tracer defaults to traces in output/traces.jsonl plus prometheus metrics (self.metrics), sampled per TRACE_SAMPLE_RATE
+    #cache_dir holds .embedding_cache/ and .answer_cache.sqlite, the working directory by default
+    def __init__(self, weaviate_client=None, index_name="BudgetSpeech", tracer=None, cache_dir="."):
+        self.cache_dir = cache_dir
         load_dotenv()
+        self.index_name = index_name
         self.setup_openai()
-        self.setup_weaviate()
+        if weaviate_client is None:
+            self.setup_weaviate()
+        else:
+            self.weaviate_client = weaviate_client
         self.setup_components()
-        self.usage_updater = UsageUpdater()
+        self.usage_updater = UsageUpdater(user="Abhishek.Yadav", model="GPT3-5")
+        #answers of repeated / near-duplicate questions over the same chunks are served without the llm
+        self.answer_cache = AnswerCache(path=os.path.join(self.cache_dir, ".answer_cache.sqlite"), embeddings=self.embeddings)
+        #per-request wall time, tokens and sizes of every stage (load, split, embed, retrieve, condense, generate)
+        self.metrics = PrometheusExporter()
+        self.tracer = tracer or Tracer.from_env([JSONLExporter(os.path.join("output", "traces.jsonl")), self.metrics])
 
     def setup_openai(self):
-        openai.api_type = "azure"
-        openai.api_version = "2023-05-15"
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-        openai.api_base = os.getenv("OPENAI_API_BASE")
+        configure_openai()
     
     #creates weviate client
     def setup_weaviate(self):
@@ -37,43 +61,65 @@ class LangChainApp:
     
     #initialises openai and embeddings
     def setup_components(self):
-        self.llm = ChatOpenAI(temperature=0.0, model_kwargs={"engine": "GPT3-5"}, headers={
+        self.llm = get_chat_model(temperature=0.0, headers={
+                            "Helicone-Auth": os.getenv('Helicone-Auth'),
+                            "Helicone-User-Id": "Abhishek.Yadav"})
+        #answer llm of streaming chains; its tokens are picked up by the handler through the "stream" tag
+        self.streaming_llm = get_chat_model(temperature=0.0, streaming=True, tags=["stream"], headers={
                             "Helicone-Auth": os.getenv('Helicone-Auth'),
                             "Helicone-User-Id": "Abhishek.Yadav"})
-        self.embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+        #same model and on-disk cache as the faiss pipeline, so no chunk is embedded twice
+        self.embeddings = CachedEmbeddings(model_name="all-MiniLM-L6-v2", cache_dir=os.path.join(self.cache_dir, ".embedding_cache"))
         print()
 
     #loads all pdfs from given directory recursively and returns chunks of all loaded data
-    def load_documents_create_chunks(self, input_directory):
-        loader = DirectoryLoader(input_directory, glob="**/*.pdf", loader_cls=PyPDFLoader)
-        pages = loader.load()
+    #stream=True parses pdfs in a process pool and returns a generator of chunks instead
+    def load_documents_create_chunks(self, input_directory, stream=False, max_workers=None):
+        #chunks end at headings and numbered paragraphs first, and carry their section and offsets
+        text_splitter = StructuredTextSplitter(chunk_size=1000, chunk_overlap=200)
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        return text_splitter.split_documents(pages)
+        if stream:
+            loader = ParallelPDFLoader.from_directory(input_directory, text_splitter, glob_pattern="**/*.pdf", recursive=True, max_workers=max_workers)
+            return loader.lazy_load()
 
-   #clears all the dimensaions strored in initialised weviate client
+        with self.tracer.trace("load_documents"):
+            loader = DirectoryLoader(input_directory, glob="**/*.pdf", loader_cls=PyPDFLoader)
+            with stage("load") as record:
+                pages = loader.load()
+                record["pages"] = len(pages)
+            with stage("split") as record:
+                chunks = text_splitter.split_documents(pages)
+                record["chunks"] = len(chunks)
+        return chunks
+
+   #clears the chunks class of this app from the initialised weviate client, other classes are kept
     def clear_dimensions(self):
-        self.weaviate_client.schema.delete_all()
+        if self.weaviate_client.schema.exists(self.index_name):
+            self.weaviate_client.schema.delete_class(self.index_name)
     
     #gets all the stored classes or collections on wiviate
     def get_collections(self):
         return self.weaviate_client.schema.get()
     
-    def build_vector_store(self, documents):
-        # try:
-        #     # Add the class to the schema
-        #     self.weaviate_client.schema.create_class(class_obj)
-        # except:
-        #     print("Class already exists")
-        # #self.weaviate_client.schema.create_class(class_obj)
-
-        # load docs into the vectorstore
-        vectorstore = Weaviate.from_documents(documents=documents, client=self.weaviate_client, embedding=self.embeddings, by_text=False)
-        
+    #upserts the chunks into one fixed class using deterministic content uuids, so re-ingesting the same
+    #pdfs only uploads new chunks. documents may be a list or a chunk generator
+    def build_vector_store(self, documents, batch_size=100, num_workers=2):
+        ingestor = WeaviateIngestor(self.weaviate_client, self.embeddings, self.index_name, batch_size=batch_size, num_workers=num_workers)
+        #with streamed documents, pdf parsing and splitting overlap the embed and upsert stages of this trace
+        with self.tracer.trace("ingest"):
+            self.ingest_report = ingestor.ingest(documents)
+        print(self.ingest_report)
+
+        if not isinstance(self.weaviate_client, weaviate.Client):
+            #stand-ins like InMemoryWeaviateClient are refused by langchain's Weaviate, same near-vector query
+            return VectorRetriever(client=self.weaviate_client, embeddings=self.embeddings, index_name=self.index_name, attributes=["source", "page"])
+        vectorstore = Weaviate(self.weaviate_client, self.index_name, "text", embedding=self.embeddings, attributes=["source", "page"], by_text=False)
         return vectorstore.as_retriever()
     
     #create conversation chain
-    def build_qa_chain(self, retriever):
+    #streaming=True streams the answer llm only; the question condensing step stays non-streaming.
+    #query_qa and stream_qa run its condense, retrieve and answer steps one by one, around the answer cache
+    def build_qa_chain(self, retriever, streaming=False):
 
         #buffer memory for the conversation chain
         memory = ConversationBufferWindowMemory(
@@ -84,40 +130,183 @@ class LangChainApp:
             return_messages=True)
 
         qa = ConversationalRetrievalChain.from_llm(
-            llm=self.llm, 
+            llm=self.streaming_llm if streaming else self.llm, 
+            condense_question_llm=self.llm,
             retriever=retriever, 
             memory=memory, 
             return_source_documents=True)
+        #the tags put the llm calls of the two sub-chains in separate trace stages
+        qa.question_generator.tags = ["condense"]
+        qa.combine_docs_chain.tags = ["generate"]
         return qa
 
 
+    #the condensing and retrieval steps of a ConversationalRetrievalChain, run ahead of its answer step so
+    #the answer cache can be checked in between. returns the standalone question (the query itself on the
+    #first turn), the formatted chat history and the chunks retrieved for the standalone question
+    def prepare_query(self, query, qa_chain, callbacks=None):
+        chat_history = qa_chain.memory.load_memory_variables({})[qa_chain.memory.memory_key]
+        history = (qa_chain.get_chat_history or _get_chat_history)(chat_history)
+        question = query
+        if history:
+            question = qa_chain.question_generator.run(question=query, chat_history=history, callbacks=callbacks)
+        docs = qa_chain.retriever.get_relevant_documents(question, callbacks=callbacks)
+        return question, history, docs
+
+    #the answer step of the chain over the chunks prepare_query retrieved, so nothing is retrieved twice
+    def answer_query(self, query, qa_chain, question, history, docs, callbacks=None):
+        answer = qa_chain.combine_docs_chain.run(input_documents=docs, question=question, chat_history=history, callbacks=callbacks)
+        qa_chain.memory.save_context({"question": query}, {"answer": answer})
+        return answer
+
     def query_qa(self, query, qa_chain):
-        with get_openai_callback() as cb:
-            res = qa_chain({"question": query})
-            #notes the llm usage
+        with self.tracer.trace("query_qa", query_chars=len(query)) as trace:
+            with get_openai_callback() as cb:
+                question, history, docs = self.prepare_query(query, qa_chain, callbacks=trace.callbacks)
+                #keyed on the standalone question and its chunks, so a follow-up like "and the year before?"
+                #only hits for the same resolved question, and a hit still reflects the current vector store
+                with stage("cache_lookup"):
+                    answer = self.answer_cache.lookup(question, docs)
+                trace.attrs["cached"] = answer is not None
+                if answer is not None:
+                    qa_chain.memory.save_context({"question": query}, {"answer": answer})
+                else:
+                    answer = self.answer_query(query, qa_chain, question, history, docs, callbacks=trace.callbacks)
+                    self.answer_cache.store(question, docs, answer)
+            #notes the llm usage; a cache hit only used the condensing call of a follow-up, if any
             self.usage_updater.update_usage(cb)
-            answer = res.get('answer')
-        return answer
+            return answer
+
+    #generator version of query_qa for a chain built with streaming=True: yields answer tokens as they arrive.
+    #streamed completions carry no token usage, so the handler counts the answer tokens locally and adds
+    #them to what get_openai_callback saw for the condensing call. timings land in self.last_stream_stats
+    def stream_qa(self, query, qa_chain):
+        #created first, so time to first token includes condensing and retrieval
+        handler = TokenStreamHandler(stream_tag="stream")
+        #started and finished by hand, the generator may be suspended between tokens for a long time.
+        #it is only made current around the stretches between yields, and finished however the stream
+        #ends: exhausted, failed, or closed early by the caller (recorded as error=GeneratorExit)
+        trace = self.tracer.start("stream_qa", query_chars=len(query))
+        try:
+            with activate(trace), get_openai_callback() as cb:
+                question, history, docs = self.prepare_query(query, qa_chain, callbacks=trace.callbacks)
+                with stage("cache_lookup"):
+                    answer = self.answer_cache.lookup(question, docs)
+            trace.attrs["cached"] = answer is not None
+            if answer is not None:
+                qa_chain.memory.save_context({"question": query}, {"answer": answer})
+                self.usage_updater.update_usage(cb)
+                elapsed = time.perf_counter() - handler.start_time
+                self.last_stream_stats = {"time_to_first_token": elapsed, "total_latency": elapsed, "cached": True}
+                trace.attrs.update(self.last_stream_stats)
+                yield answer
+                return
+
+            def run(handler):
+                return self.answer_query(query, qa_chain, question, history, docs, callbacks=[handler] + trace.callbacks)
+
+            stream = TokenStream(run, handler)
+            yield from stream
+
+            answer = stream.result
+            #notes the llm usage
+            self.usage_updater.update_usage(handler.usage(cb, model_name=self.streaming_llm.model_name))
+            with activate(trace):
+                self.answer_cache.store(question, docs, answer)
+            self.last_stream_stats = {"time_to_first_token": handler.time_to_first_token, "total_latency": handler.total_latency, "cached": False}
+            trace.attrs.update(self.last_stream_stats)
+        except BaseException as error:
+            trace.attrs["error"] = type(error).__name__
+            raise
+        finally:
+            self.tracer.finish(trace)
+
+    #runs query_qa in a worker thread, retrying with exponential backoff when rate limited.
+    #a thread cannot be cancelled, so a turn that times out is not retried, and release (if given) is only
+    #called once the worker thread has finished; until then the chain and its memory stay with this turn
+    async def query_with_retry(self, query, qa_chain, timeout=60, max_retries=3, backoff=1.0, release=None):
+        worker = None
+        try:
+            for attempt in range(max_retries + 1):
+                worker = asyncio.ensure_future(asyncio.to_thread(self.query_qa, query, qa_chain))
+                try:
+                    return await asyncio.wait_for(asyncio.shield(worker), timeout)
+                except RateLimitError:
+                    if attempt == max_retries:
+                        raise
+                    await asyncio.sleep(backoff * 2 ** attempt + random.uniform(0, backoff))
+        finally:
+            if release is not None:
+                if worker is None or worker.done():
+                    release()
+                else:
+                    def on_done(future):
+                        #nobody waits for the answer of a timed out turn any more
+                        if not future.cancelled():
+                            future.exception()
+                        release()
+                    worker.add_done_callback(on_done)
+
+    #answers many queries concurrently, at most max_concurrency at a time, results in input order.
+    #every session gets its own chain and memory; queries sharing a session id run one after another.
+    #a failed or timed out query yields its exception in place of the answer. the session lock and
+    #concurrency slot of a timed out query are held until its worker thread is done
+    async def query_many(self, queries, retriever, max_concurrency=4, timeout=60, max_retries=3, session_ids=None):
+        session_ids = list(range(len(queries))) if session_ids is None else session_ids
+        semaphore = asyncio.Semaphore(max_concurrency)
+        chains = {session_id: self.build_qa_chain(retriever) for session_id in set(session_ids)}
+        locks = {session_id: asyncio.Lock() for session_id in chains}
+
+        async def run(query, session_id):
+            lock = locks[session_id]
+            await lock.acquire()
+            try:
+                await semaphore.acquire()
+            except BaseException:
+                lock.release()
+                raise
+
+            def release():
+                semaphore.release()
+                lock.release()
+            return await self.query_with_retry(query, chains[session_id], timeout, max_retries, release=release)
+
+        return await asyncio.gather(*(run(query, session_id) for query, session_id in zip(queries, session_ids)), return_exceptions=True)
 
     
 if __name__ == "__main__":
     app = LangChainApp()
-    documents = app.load_documents_create_chunks('./input')
+    documents = app.load_documents_create_chunks('./input', stream=True)
     retriever = app.build_vector_store(documents)
-    qa_chain = app.build_qa_chain(retriever)
 
     queries = [
         "Vision for Amrit Kaal",
         "Pradhan Mantri PVTG Development Mission",
         "Vivad se Vishwas"
     ]
-    
-    app.clear_dimensions()
 
-    for query in queries:
-        print(query + ":", app.query_qa(query, qa_chain))
-        print("****************************************************************************")
+    if "--stream" in sys.argv:
+        #prints the answers token by token, one query after another
+        qa_chain = app.build_qa_chain(retriever, streaming=True)
+        for query in queries:
+            print(query + ":", end=" ", flush=True)
+            for token in app.stream_qa(query, qa_chain):
+                print(token, end="", flush=True)
+            stats = app.last_stream_stats
+            print(f"\n[time to first token {stats['time_to_first_token']:.2f}s, total {stats['total_latency']:.2f}s]")
+            print("****************************************************************************")
+    else:
+        answers = asyncio.run(app.query_many(queries, retriever, max_concurrency=3))
+        for query, answer in zip(queries, answers):
+            print(query + ":", answer)
+            print("****************************************************************************")
 
     print(app.usage_updater.get_daily_usage())
+    app.usage_updater.export_json()
+    #per-stage latency histograms and token counters, for the node_exporter textfile collector
+    app.metrics.write(os.path.join("output", "metrics.prom"))
+    #the class is kept between runs on purpose: ingest upserts by chunk id and skips chunks already
+    #stored, so a rerun only uploads new chunks. clear_dimensions() deletes the class and all its
+    #objects, e.g. to drop chunks of removed pdfs or objects stored under an older chunk id scheme
     # app.clear_dimensions()
     # print(app.get_collections())
@@ -0,0 +1,67 @@
+import os
+import sys
+import asyncio
+from typing import Any, List, Optional
+
+from langchain.docstore.document import Document
+from langchain.schema import BaseRetriever
+
+
+#near-vector retriever over any client with weaviate's query builder. langchain's Weaviate vector store
+#refuses everything but a real weaviate.Client, so LangChainApp uses this one for stand-ins such as the
+#InMemoryWeaviateClient. it sends the same query as Weaviate(by_text=False).as_retriever()
+
+class VectorRetriever(BaseRetriever):
+    client: Any
+    embeddings: Any
+    index_name: str
+    text_key: str = "text"
+    attributes: List[str] = []
+    k: int = 4
+    where_filter: Optional[dict] = None
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        builder = self.client.query.get(self.index_name, [self.text_key] + self.attributes)
+        if self.where_filter:
+            builder = builder.with_where(self.where_filter)
+        result = builder.with_near_vector({"vector": self.embeddings.embed_query(query)}).with_limit(self.k).do()
+        if "errors" in result:
+            raise ValueError(f"weaviate query failed: {result['errors']}")
+
+        docs = []
+        for row in result["data"]["Get"][self.index_name]:
+            metadata = {key: value for key, value in row.items() if key not in (self.text_key, "_additional")}
+            docs.append(Document(page_content=row[self.text_key], metadata=metadata))
+        return docs
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        return await asyncio.to_thread(self._get_relevant_documents, query)
+
+
+if __name__ == "__main__":
+    #round trip through the in-memory client: chunks ingested by LangChainApp come back from a query
+    import tempfile
+
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    from benchmarks.fakes import HashEmbeddings
+    from inmemory_client import InMemoryWeaviateClient
+    from main import LangChainApp
+
+    os.environ.setdefault("OPENAI_API_KEY", "check")
+    os.chdir(tempfile.mkdtemp())
+    app = LangChainApp(weaviate_client=InMemoryWeaviateClient(), cache_dir=tempfile.mkdtemp())
+    app.embeddings = HashEmbeddings()
+    chunks = [
+        Document(page_content="green hydrogen mission and energy transition", metadata={"source": "input/a.pdf", "page": 1}),
+        Document(page_content="railway capital expenditure and infrastructure", metadata={"source": "input/a.pdf", "page": 2}),
+        Document(page_content="customs duty exemption on exports", metadata={"source": "input/b.pdf", "page": 7}),
+    ]
+    retriever = app.build_vector_store(chunks)
+    docs = retriever.get_relevant_documents("railway infrastructure capital")
+    assert docs[0].page_content == chunks[1].page_content, docs
+    assert docs[0].metadata == {"source": "input/a.pdf", "page": 2}, docs[0].metadata
+    assert app.build_vector_store(chunks) and app.ingest_report["skipped_existing"] == len(chunks), app.ingest_report
+
+    retriever.where_filter = {"path": ["source"], "operator": "Equal", "valueText": "input/b.pdf"}
+    assert [doc.metadata["page"] for doc in retriever.get_relevant_documents("railway")] == [7]
+    print("in-memory round trip ok")